@@ -12,11 +12,74 @@ RAG_WORKING_DIR = os.getenv("LIGHTRAG_WORKING_DIR", str(PROJECT_ROOT / "rag_stor
 
 # xAI / Grok
 XAI_API_KEY = os.getenv("XAI_API_KEY", "")
-XAI_BASE_URL = "https://api.x.ai/v1"
+XAI_BASE_URL = os.getenv("XAI_BASE_URL", "https://api.x.ai/v1")
 GROK_MODEL = "grok-4-1-fast-non-reasoning"  # 2M context, cheapest variant
+# Tasks Grok serves: chat, extraction (LightRAG indexing and keywords) and
+# long_writing (handbook sections); empty = Grok unused (see LLM_BACKENDS)
+GROK_TASKS = os.getenv("GROK_TASKS", "chat,extraction,long_writing")
+
+# More OpenAI-compatible LLM backends, e.g. a local vLLM or llama.cpp server,
+# in preference order ("grok" may be listed to place it; otherwise it comes
+# first). Each NAME is configured with LLM_<NAME>_BASE_URL, LLM_<NAME>_MODEL,
+# LLM_<NAME>_API_KEY, LLM_<NAME>_TASKS and optionally LLM_<NAME>_RPM / _TPM /
+# _MAX_INFLIGHT.
+LLM_BACKENDS = [name.strip().lower() for name in os.getenv("LLM_BACKENDS", "").split(",") if name.strip()]
+# Routing between backends: EWMA weight of each new latency/error sample, how
+# much slower than the fastest backend the preferred one may be before it is
+# passed over, error rate that marks a backend unhealthy and seconds before
+# it is tried again, retries on a backend before failing over, and tasks whose
+# slow async calls are hedged on the next backend after LLM_HEDGE_FACTOR x
+# the usual latency (at least LLM_HEDGE_MIN_DELAY seconds)
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.2"))
+LLM_SLOW_FACTOR = float(os.getenv("LLM_SLOW_FACTOR", "2.0"))
+LLM_UNHEALTHY_ERROR_RATE = float(os.getenv("LLM_UNHEALTHY_ERROR_RATE", "0.5"))
+LLM_BACKEND_COOLDOWN = float(os.getenv("LLM_BACKEND_COOLDOWN", "30"))
+LLM_FAILOVER_RETRIES = int(os.getenv("LLM_FAILOVER_RETRIES", "0"))
+LLM_HEDGE_TASKS = tuple(
+    task.strip() for task in os.getenv("LLM_HEDGE_TASKS", "chat,extraction").split(",") if task.strip()
+)
+LLM_HEDGE_FACTOR = float(os.getenv("LLM_HEDGE_FACTOR", "3.0"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+
+# HTTP connection pool shared by all LLM clients (keep-alive reuse)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+
+# Request scheduler in front of every LLM call: requests and tokens per minute
+# (0 = unlimited), requests on the wire at once (0 = LLM_MAX_CONNECTIONS),
+# retries of 429/5xx/timeouts with jittered exponential backoff (base and cap
+# in seconds), per-call deadlines in seconds for interactive and background
+# calls, and whether interactive calls are admitted ahead of background ones
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_BACKGROUND_TIMEOUT = float(os.getenv("LLM_BACKGROUND_TIMEOUT", "600"))
+LLM_PRIORITY_LANES = os.getenv("LLM_PRIORITY_LANES", "true").lower() in ("1", "true", "yes")
 
 # OpenAI (for embeddings)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+
+# Embedding backend: "openai" (default) or "local" (sentence-transformers on CPU).
+# Changing backend or dimension needs a fresh LIGHTRAG_WORKING_DIR.
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "openai").lower()
+LOCAL_EMBED_MODEL = os.getenv("LOCAL_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+LOCAL_EMBED_RUNTIME = os.getenv("LOCAL_EMBED_RUNTIME", "torch")  # or "onnx"
+LOCAL_EMBED_THREADS = int(os.getenv("LOCAL_EMBED_THREADS", "1"))
+LOCAL_EMBED_BATCH_SIZE = int(os.getenv("LOCAL_EMBED_BATCH_SIZE", "32"))
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", "1536" if EMBED_BACKEND == "openai" else "384"))
+
+# Embedding layer: vectors cached by content hash, texts per request and
+# estimated tokens per request (provider limits), and requests in flight
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", str(Path(RAG_WORKING_DIR) / "embed_cache"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "100000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
 
 # Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
@@ -29,16 +92,132 @@ POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "")
 POSTGRES_DATABASE = os.getenv("POSTGRES_DATABASE", "postgres")
 
+# Opt-in disk cache for LLM responses (repeated demo questions, retries)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(Path(RAG_WORKING_DIR) / "llm_cache.sqlite"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "0"))  # seconds, 0 = never expire
+
+# Handbook generation: sections written concurrently (1 = strictly sequential)
+# and how many consecutive plan steps form one wave of parallel writing
+HANDBOOK_CONCURRENCY = int(os.getenv("HANDBOOK_CONCURRENCY", "1"))
+HANDBOOK_WAVE_SIZE = int(os.getenv("HANDBOOK_WAVE_SIZE", "8"))
+# Plan parsing: most steps kept (the shortest neighbours are merged beyond
+# that), the word target of steps that give none, and the range targets are
+# clamped to
+HANDBOOK_MAX_STEPS = int(os.getenv("HANDBOOK_MAX_STEPS", "60"))
+HANDBOOK_STEP_WORDS = int(os.getenv("HANDBOOK_STEP_WORDS", "700"))
+HANDBOOK_MIN_STEP_WORDS = int(os.getenv("HANDBOOK_MIN_STEP_WORDS", "150"))
+HANDBOOK_MAX_STEP_WORDS = int(os.getenv("HANDBOOK_MAX_STEP_WORDS", "2000"))
+# Section length control: prior tokens-per-word ratio (replaced by the
+# measured one once sections come back), max_tokens headroom over a step's
+# word target, the share of the target below which a section is continued,
+# continuation calls per section, and a hard cap on any section's max_tokens
+HANDBOOK_TOKENS_PER_WORD = float(os.getenv("HANDBOOK_TOKENS_PER_WORD", "1.35"))
+HANDBOOK_LENGTH_HEADROOM = float(os.getenv("HANDBOOK_LENGTH_HEADROOM", "1.5"))
+HANDBOOK_MIN_LENGTH = float(os.getenv("HANDBOOK_MIN_LENGTH", "0.8"))
+HANDBOOK_MAX_CONTINUATIONS = int(os.getenv("HANDBOOK_MAX_CONTINUATIONS", "1"))
+HANDBOOK_MAX_SECTION_TOKENS = int(os.getenv("HANDBOOK_MAX_SECTION_TOKENS", "8192"))
+# Token window for each section-writing prompt (instruction, plan, context,
+# earlier text are trimmed to fit)
+HANDBOOK_PROMPT_TOKENS = int(os.getenv("HANDBOOK_PROMPT_TOKENS", "8000"))
+# Writer memory: LLM summaries of earlier sections (false = extractive only),
+# summary length, summaries kept before the oldest are rolled up, and the
+# verbatim tail of the document shown alongside them
+HANDBOOK_LLM_SUMMARIES = os.getenv("HANDBOOK_LLM_SUMMARIES", "true").lower() in ("1", "true", "yes")
+HANDBOOK_SUMMARY_WORDS = int(os.getenv("HANDBOOK_SUMMARY_WORDS", "60"))
+HANDBOOK_SUMMARY_SLOTS = int(os.getenv("HANDBOOK_SUMMARY_SLOTS", "16"))
+HANDBOOK_TAIL_TOKENS = int(os.getenv("HANDBOOK_TAIL_TOKENS", "1500"))
+# Per-section retrieval for the writer: on/off, plan steps retrieved per batch
+# (the next batch is prefetched while writing), and chunk texts kept for reuse
+HANDBOOK_SECTION_CONTEXT = os.getenv("HANDBOOK_SECTION_CONTEXT", "true").lower() in ("1", "true", "yes")
+HANDBOOK_PREFETCH = int(os.getenv("HANDBOOK_PREFETCH", "4"))
+HANDBOOK_CHUNK_CACHE = int(os.getenv("HANDBOOK_CHUNK_CACHE", "256"))
+# Minimum seconds between streamed UI updates while a handbook is written
+HANDBOOK_STREAM_INTERVAL = float(os.getenv("HANDBOOK_STREAM_INTERVAL", "0.25"))
+
+# PDF extraction: worker processes (0 = one per CPU) and pages per shard
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Upper bound on the text handed to LightRAG per insert when streaming a PDF
+INSERT_CHUNK_TOKENS = int(os.getenv("INSERT_CHUNK_TOKENS", "8000"))
+# Extracted chunks cached by PDF content hash, so re-uploads skip pdfplumber
+EXTRACT_CACHE_DIR = os.getenv("EXTRACT_CACHE_DIR", str(Path(RAG_WORKING_DIR) / "extract_cache"))
+
+# Upload pipeline: files extracted concurrently, chunks buffered between
+# extraction and indexing, and documents per LightRAG insert call
+INGEST_EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", "2"))
+INGEST_QUEUE_CHUNKS = int(os.getenv("INGEST_QUEUE_CHUNKS", "8"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "8"))
+
+# Query results cached until the next insert: max entries (0 = off) and TTL
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))  # seconds, 0 = no expiry
+
+# Token budget for retrieved context (entities, relations, chunks) per chat turn
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "12000"))
+
+# Token budget per sub-query for batch retrieval (rag_engine.retrieve_contexts)
+SECTION_CONTEXT_TOKENS = int(os.getenv("SECTION_CONTEXT_TOKENS", "3000"))
+
+# Load the LightRAG storages in the background at startup instead of on the first request
+RAG_WARMUP = os.getenv("RAG_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Batches or queries in flight for rag_engine.insert_many_sync / query_many_sync
+RAG_BULK_CONCURRENCY = int(os.getenv("RAG_BULK_CONCURRENCY", "4"))
+
 # LightRAG tuning
 CHUNK_TOKEN_SIZE = 1200
 CHUNK_OVERLAP_TOKEN_SIZE = 100
 
 
+def _tasks(value: str) -> tuple[str, ...]:
+    return tuple(task.strip() for task in value.split(",") if task.strip())
+
+
+def llm_backends() -> list[dict]:
+    """Settings of every LLM backend in preference order (see LLM_BACKENDS)."""
+    grok = {
+        "name": "grok",
+        "base_url": XAI_BASE_URL,
+        "api_key": XAI_API_KEY,
+        "model": GROK_MODEL,
+        "tasks": _tasks(GROK_TASKS),
+        "rpm": LLM_RPM,
+        "tpm": LLM_TPM,
+        "max_inflight": LLM_MAX_INFLIGHT,
+    }
+    backends = [] if "grok" in LLM_BACKENDS or not grok["tasks"] else [grok]
+    for name in LLM_BACKENDS:
+        if name == "grok":
+            if grok["tasks"]:
+                backends.append(grok)
+            continue
+        prefix = f"LLM_{name.upper()}_"
+        backends.append({
+            "name": name,
+            "base_url": os.getenv(prefix + "BASE_URL", ""),
+            "api_key": os.getenv(prefix + "API_KEY", "EMPTY"),  # local servers accept any key
+            "model": os.getenv(prefix + "MODEL", ""),
+            "tasks": _tasks(os.getenv(prefix + "TASKS", "chat,extraction,long_writing")),
+            "rpm": float(os.getenv(prefix + "RPM", "0")),
+            "tpm": float(os.getenv(prefix + "TPM", "0")),
+            "max_inflight": int(os.getenv(prefix + "MAX_INFLIGHT", "0")),
+        })
+    return backends
+
+
 def validate():
     """Check that required env vars are set. Returns list of missing keys."""
-    required = {
-        "XAI_API_KEY": XAI_API_KEY,
-        "OPENAI_API_KEY": OPENAI_API_KEY,
-    }
+    required = {}
+    for backend in llm_backends():
+        if backend["name"] == "grok":
+            required["XAI_API_KEY"] = XAI_API_KEY
+        else:
+            prefix = f"LLM_{backend['name'].upper()}_"
+            required[prefix + "BASE_URL"] = backend["base_url"]
+            required[prefix + "MODEL"] = backend["model"]
+    if EMBED_BACKEND == "openai":
+        required["OPENAI_API_KEY"] = OPENAI_API_KEY
     missing = [k for k, v in required.items() if not v]
     return missing
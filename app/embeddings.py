@@ -0,0 +1,257 @@
+"""Batched, cached embedding layer for LightRAG's EmbeddingFunc.
+
+Texts are deduplicated within each call, looked up in a persistent
+content-hash -> float32 vector cache (a memory-mapped file), and only the
+misses are sent upstream, packed into requests that respect the provider's
+input-count and token limits and run concurrently under a semaphore.
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+from lightrag.llm.openai import openai_embed
+
+from app import config
+
+_INDEX_LINE_RE = re.compile(rb"[0-9a-f]{64}\n")
+
+
+class VectorCache:
+    """Persistent map from content hash to a float32 vector.
+
+    Vectors live in ``vectors-<dim>.f32``, a memory-mapped N x dim array that
+    grows by doubling; ``index-<dim>.txt`` lists one hash per row. Rows are
+    written before their index line, so a crash can only lose entries, never
+    point a hash at the wrong vector; a torn last index line is cut off on
+    load so the next append starts on a line of its own.
+    """
+
+    def __init__(self, directory: str | Path, dim: int):
+        self.dim = dim
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self._data_path = directory / f"vectors-{dim}.f32"
+        self._index_path = directory / f"index-{dim}.txt"
+        self._lock = threading.Lock()
+        self._rows: dict[str, int] = {}
+        self._data_path.touch(exist_ok=True)
+        self._capacity = self._data_path.stat().st_size // (dim * 4)
+        self._load_index()
+        self._map = self._open_map()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _load_index(self) -> None:
+        """Read the index up to its first torn or unbacked line and cut the rest off."""
+        if not self._index_path.exists():
+            return
+        kept = 0  # bytes of complete index lines with a vector row on disk
+        with open(self._index_path, "rb") as f:
+            for row, line in enumerate(f):
+                if row >= self._capacity or not _INDEX_LINE_RE.fullmatch(line):
+                    break
+                self._rows[line[:-1].decode("ascii")] = row
+                kept += len(line)
+        if kept < self._index_path.stat().st_size:
+            with open(self._index_path, "r+b") as f:
+                f.truncate(kept)
+
+    def _open_map(self):
+        if not self._capacity:
+            return None
+        return np.memmap(self._data_path, dtype=np.float32, mode="r+", shape=(self._capacity, self.dim))
+
+    def _ensure_capacity(self, rows: int) -> None:
+        if rows <= self._capacity:
+            return
+        capacity = max(rows, self._capacity * 2, 1024)
+        if self._map is not None:
+            self._map.flush()
+            del self._map
+        with open(self._data_path, "r+b") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._capacity = capacity
+        self._map = self._open_map()
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        with self._lock:
+            return {k: np.array(self._map[self._rows[k]]) for k in keys if k in self._rows}
+
+    def put_many(self, keys: list[str], vectors: np.ndarray) -> None:
+        with self._lock:
+            new = [(k, v) for k, v in zip(keys, vectors) if k not in self._rows]
+            if not new:
+                return
+            start = len(self._rows)
+            self._ensure_capacity(start + len(new))
+            for offset, (_, vector) in enumerate(new):
+                self._map[start + offset] = vector
+            self._map.flush()
+            with open(self._index_path, "a", encoding="ascii") as f:
+                for offset, (key, _) in enumerate(new):
+                    f.write(key + "\n")
+                    self._rows[key] = start + offset
+
+
+def _estimate_tokens(text: str) -> int:
+    # Conservative (about 3 chars per token) so packed requests stay under the limit
+    return len(text) // 3 + 1
+
+
+class BatchedEmbedder:
+    """Async embedding function with dedup, caching, packing and concurrency.
+
+    ``embed`` is the upstream ``async (list[str]) -> np.ndarray`` call. An
+    instance is itself such a call, so it can be passed as
+    ``EmbeddingFunc(func=...)``.
+    """
+
+    def __init__(
+        self,
+        embed,
+        dim: int,
+        model: str,
+        cache: VectorCache | None = None,
+        max_batch: int | None = None,
+        max_batch_tokens: int | None = None,
+        concurrency: int | None = None,
+    ):
+        self.embed = embed
+        self.dim = dim
+        self.model = model
+        self.cache = cache
+        self.max_batch = max_batch or config.EMBED_BATCH_SIZE
+        self.max_batch_tokens = max_batch_tokens or config.EMBED_BATCH_TOKENS
+        self._semaphore = asyncio.Semaphore(concurrency or config.EMBED_CONCURRENCY)
+        self.stats = {"texts": 0, "duplicates": 0, "cache_hits": 0, "embedded": 0, "requests": 0}
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _pack(self, keys: list[str], texts: dict[str, str]) -> list[list[str]]:
+        batches, batch, tokens = [], [], 0
+        for key in keys:
+            cost = _estimate_tokens(texts[key])
+            if batch and (len(batch) >= self.max_batch or tokens + cost > self.max_batch_tokens):
+                batches.append(batch)
+                batch, tokens = [], 0
+            batch.append(key)
+            tokens += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def _embed_batch(self, keys: list[str], texts: dict[str, str]) -> np.ndarray:
+        async with self._semaphore:
+            self.stats["requests"] += 1
+            vectors = await self.embed([texts[k] for k in keys])
+        return np.asarray(vectors, dtype=np.float32)
+
+    async def __call__(self, texts: list[str], **kwargs) -> np.ndarray:
+        keys = [self._key(t) for t in texts]
+        unique = dict(zip(keys, texts))
+        self.stats["texts"] += len(texts)
+        self.stats["duplicates"] += len(texts) - len(unique)
+
+        found = self.cache.get_many(list(unique)) if self.cache is not None else {}
+        self.stats["cache_hits"] += len(found)
+        missing = [k for k in unique if k not in found]
+
+        batches = self._pack(missing, unique)
+        results = await asyncio.gather(*(self._embed_batch(b, unique) for b in batches))
+        for batch, vectors in zip(batches, results):
+            found.update(zip(batch, vectors))
+            if self.cache is not None:
+                self.cache.put_many(batch, vectors)
+        self.stats["embedded"] += len(missing)
+
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for row, key in enumerate(keys):
+            out[row] = found[key]
+        return out
+
+
+def openai_embedder(dim: int) -> BatchedEmbedder:
+    """Cached, batched embedder over the OpenAI embeddings API."""
+    # text-embedding-3 models can shorten their vectors to ``dim``
+    dimensions = dim if config.OPENAI_EMBED_MODEL.startswith("text-embedding-3") else None
+
+    async def embed(texts: list[str]) -> np.ndarray:
+        return await openai_embed.func(
+            texts,
+            model=config.OPENAI_EMBED_MODEL,
+            api_key=config.OPENAI_API_KEY,
+            embedding_dim=dimensions,
+        )
+
+    return BatchedEmbedder(
+        embed, dim, config.OPENAI_EMBED_MODEL, cache=VectorCache(config.EMBED_CACHE_DIR, dim)
+    )
+
+
+def _load_local_model(name: str, runtime: str):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError(
+            "EMBED_BACKEND=local requires sentence-transformers "
+            "(pip install sentence-transformers, plus optimum[onnxruntime] for onnx)"
+        ) from e
+    if runtime == "torch":
+        return SentenceTransformer(name, device="cpu")
+    return SentenceTransformer(name, device="cpu", backend=runtime)
+
+
+def local_embedder(dim: int) -> BatchedEmbedder:
+    """Cached, batched embedder running a sentence-transformers model on CPU.
+
+    Inference runs on a small dedicated thread pool so the event loop stays
+    free; the model itself already spreads each batch across cores.
+    """
+    model = _load_local_model(config.LOCAL_EMBED_MODEL, config.LOCAL_EMBED_RUNTIME)
+    model_dim = model.get_sentence_embedding_dimension()
+    if model_dim != dim:
+        raise ValueError(
+            f"{config.LOCAL_EMBED_MODEL} produces {model_dim}-dimensional vectors "
+            f"but EMBEDDING_DIM is {dim}"
+        )
+    threads = max(1, config.LOCAL_EMBED_THREADS)
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="embed")
+    encode = partial(
+        model.encode,
+        batch_size=config.LOCAL_EMBED_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    )
+
+    async def embed(texts: list[str]) -> np.ndarray:
+        return await asyncio.get_running_loop().run_in_executor(executor, encode, texts)
+
+    return BatchedEmbedder(
+        embed,
+        dim,
+        f"local:{config.LOCAL_EMBED_MODEL}",
+        cache=VectorCache(config.EMBED_CACHE_DIR, dim),
+        concurrency=threads,
+    )
+
+
+_BACKENDS = {"openai": openai_embedder, "local": local_embedder}
+
+
+def get_embedder(dim: int | None = None) -> BatchedEmbedder:
+    """Build the embedder for ``config.EMBED_BACKEND``."""
+    backend = _BACKENDS.get(config.EMBED_BACKEND)
+    if backend is None:
+        raise ValueError(
+            f"Unknown EMBED_BACKEND {config.EMBED_BACKEND!r} (expected one of: {', '.join(_BACKENDS)})"
+        )
+    return backend(dim or config.EMBEDDING_DIM)
@@ -3,7 +3,18 @@
 Adapted from LongWriter-main/agentwrite/ to use Grok 4.1 and RAG context.
 """
 
-from app.llm_client import chat
+import asyncio
+import concurrent.futures
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import NamedTuple
+
+import tiktoken
+
+from app import config, rag_engine
+from app.handbook_journal import HandbookJournal
+from app.llm_client import achat, achat_stream, chat, chat_stream
 
 # ---------------------------------------------------------------------------
 # Prompt templates (adapted from LongWriter prompts/)
@@ -48,10 +59,18 @@ Full writing plan:
 
 {plan}
 
-Already written text (last 3000 words shown for context):
+Summaries of the sections already written:
+
+{summaries}
+
+End of the already written text (shown verbatim for continuity):
 
 {text}
 
+Source material retrieved for this section:
+
+{context}
+
 YOUR TASK: Write {step}
 
 IMPORTANT RULES:
@@ -62,48 +81,1015 @@ IMPORTANT RULES:
 - Do NOT write a conclusion or wrap up the document — more sections will follow\
 """
 
+# Used in parallel mode: sections of one wave are written at the same time, so
+# they see summaries of earlier waves instead of the literal preceding text.
+PARALLEL_WRITE_PROMPT = """\
+You are an expert technical writer creating a comprehensive handbook. Write the assigned section with depth, detail, and substance. Use specific examples, data points, and thorough explanations.
+
+Writing instruction:
+
+{instruction}
+
+Full writing plan:
+
+{plan}
+
+Summaries of the sections already written:
+
+{summaries}
+
+Sections being written at the same time as yours (do NOT cover their content):
+
+{siblings}
+
+Source material retrieved for this section:
+
+{context}
+
+YOUR TASK: Write {step}
+
+IMPORTANT RULES:
+- You MUST write AT LEAST the word count specified in the step above
+- Include detailed explanations, examples, and analysis
+- Use proper markdown formatting with headers (##, ###), bullet points, and emphasis where appropriate
+- Only output the new section — do NOT repeat content from the summarized sections
+- Do NOT write a conclusion or wrap up the document — more sections will follow\
+"""
+
+# Sent when a section came back well short of its step's word target: the
+# model extends it instead of the whole section being written again.
+CONTINUE_PROMPT = """\
+You are an expert technical writer completing one section of a comprehensive handbook. The section below is shorter than its assignment requires.
+
+The section's assignment:
+
+{step}
+
+The section so far:
+
+{text}
+
+YOUR TASK: Continue this section with about {words} more words of new material on the same main point — further detail, examples and analysis.
+
+IMPORTANT RULES:
+- Only output the continuation — do NOT repeat or restate the text above, and do NOT start with a new section heading
+- Use the same markdown style as the section so far
+- Do NOT write a conclusion or wrap up the document — more sections will follow\
+"""
+
+SUMMARY_PROMPT = """\
+Summarize this handbook section in at most {words} words. Keep the key terms, claims and examples that later sections must not repeat or contradict. Output only the summary.
+
+{text}\
+"""
+
+ROLLUP_PROMPT = """\
+Merge these summaries of consecutive handbook sections into one summary of at most {words} words. Keep the key terms and claims. Output only the summary.
+
+{summaries}\
+"""
+
+_HEADING_RE = re.compile(r"^#{1,6}\s+(.+?)\s*$", re.MULTILINE)
+# Plan lines: an optional "Paragraph N" / "Section N" / "Step N" / "N." label
+# (inside any markdown bullets or emphasis, but never a "#" heading), an
+# optional "Main Point:" label, and a word target at the end ("Word Count:
+# 700 words", "(600-800 words)", ...)
+_STEP_LABEL_RE = re.compile(
+    r"^[\s>*_-]*(?:(?:paragraph|section|step)\s*(\d+)|(\d+)\s*[.):])[\s*_]*[-–—:.)]?\s*",
+    re.IGNORECASE,
+)
+_MAIN_POINT_RE = re.compile(r"^[\s*_]*main\s*point\s*[:\-–—]\s*", re.IGNORECASE)
+_WORD_COUNT_RE = re.compile(
+    r"[\s,;|(\[*_\-–—]*"
+    r"(?:word\s*count[*_\s]*[:\-–—]?\s*(?:~|about|around|approx\.?)?\s*(\d[\d,]*)(?:\s*[-–]\s*(\d[\d,]*))?(?:\s*words?)?"
+    r"|(?:~|about|around|approx\.?)?\s*(\d[\d,]*)(?:\s*[-–]\s*(\d[\d,]*))?\s*words?)"
+    r"[)\]*_.\s]*$",
+    re.IGNORECASE,
+)
+# Markdown emphasis around labels ("**Word Count:** 700"), not snake_case
+_EMPHASIS_RE = re.compile(r"\*+|(?<!\w)_+|_+(?!\w)")
+_HEADER_ONLY_RE = re.compile(r"^[\s#*_>|=-]*$|^#{1,6}\s|:\s*$")
+_SENTENCE_RE = re.compile(r"^(.+?[.!?])(?:\s|$)")
+
+# Written after every section in the assembled handbook, and between a short
+# section and its continuation
+SECTION_SEPARATOR = "\n\n"
+
+NO_SECTION_CONTEXT = "(No specific source material found for this section.)"
+
+# Share of the writer prompt's token window each part may use at most; what
+# they leave over goes to the already written text (or section summaries).
+PROMPT_SHARES = {"instruction": 0.1, "context": 0.35, "plan": 0.2, "summaries": 0.2}
+
+
+class PlanStep:
+    """One step of the handbook plan: 0-based ``index``, what to write, how long."""
+
+    __slots__ = ("index", "main_point", "target_words")
+
+    def __init__(self, index: int, main_point: str, target_words: int):
+        self.index = index
+        self.main_point = main_point
+        self.target_words = target_words
+
+    def line(self) -> str:
+        """The step in the plan's canonical one-line form, as the writer sees it."""
+        return f"Paragraph {self.index + 1} - Main Point: {self.main_point} - Word Count: {self.target_words} words"
+
+    __str__ = line
+
+    def __repr__(self) -> str:
+        return f"PlanStep({self.index}, {self.main_point!r}, {self.target_words})"
+
+
+def _word_target(match: re.Match) -> int | None:
+    low, high = match.group(1) or match.group(3), match.group(2) or match.group(4)
+    try:
+        low = int(low.replace(",", ""))
+        return (low + int(high.replace(",", ""))) // 2 if high else low
+    except ValueError:
+        return None
+
+
+def _merge_steps(steps: list[list], max_steps: int, max_words: int) -> list[list]:
+    """Merge the adjacent pair with the smallest combined target until ``max_steps`` remain."""
+    while len(steps) > max_steps:
+        j = min(range(len(steps) - 1), key=lambda k: steps[k][1] + steps[k + 1][1])
+        (point, words), (next_point, next_words) = steps[j], steps.pop(j + 1)
+        steps[j] = [f"{point.rstrip('.; ')}; {next_point}", min(words + next_words, max_words)]
+    return steps
+
+
+def _parse_plan(response: str, max_steps: int | None = None) -> list[PlanStep]:
+    """Plan steps from the planner's reply, repaired and renumbered.
+
+    Preambles, headings, blank lines and closing chatter are dropped; a
+    description wrapped onto the next line (indented, starting in lower
+    case or holding just the word target) is joined back to its step; steps
+    without a word target get ``config.HANDBOOK_STEP_WORDS`` and every
+    target is clamped to the configured range. Beyond ``max_steps`` (default
+    ``config.HANDBOOK_MAX_STEPS``) the shortest neighbouring steps are merged.
+    A reply without any recognizable step falls back to one step per line.
+    """
+    max_steps = max(1, max_steps or config.HANDBOOK_MAX_STEPS)
+    low, high = config.HANDBOOK_MIN_STEP_WORDS, config.HANDBOOK_MAX_STEP_WORDS
+    steps: list[list] = []  # [main point, target or None]
+    loose: list[str] = []  # unlabelled lines, used only if nothing else parses
+    open_step = False  # the last step still lacks its word target
+    for raw in response.splitlines():
+        line = _EMPHASIS_RE.sub("", raw).strip()
+        if not line or _HEADER_ONLY_RE.search(line) and not _STEP_LABEL_RE.match(line):
+            open_step = False
+            continue
+        label = _STEP_LABEL_RE.match(line)
+        text = line[label.end():] if label else line
+        point_label = _MAIN_POINT_RE.match(text)
+        text = text[point_label.end():] if point_label else text
+        count = _WORD_COUNT_RE.search(text)
+        words = _word_target(count) if count else None
+        point = (text[:count.start()] if count else text).strip(" \t-–—:|,;*_")
+        if label or point_label:
+            if point:
+                steps.append([point, words])
+                open_step = words is None
+        elif open_step and (raw[:1].isspace() or point[:1].islower() or not point):
+            # Continuation of a description wrapped onto the next line
+            if point:
+                steps[-1][0] = f"{steps[-1][0]} {point}"
+            steps[-1][1] = words
+            open_step = words is None
+        elif point:
+            open_step = False  # prose after a step ends it
+            loose.append(point)
+    if not steps:
+        steps = [[point, None] for point in loose]
+    for step in steps:
+        step[1] = min(max(step[1] or config.HANDBOOK_STEP_WORDS, low), high)
+    steps = _merge_steps(steps, max_steps, high)
+    return [PlanStep(i, point, words) for i, (point, words) in enumerate(steps)]
+
+
+class HandbookDocument:
+    """Append-only handbook text with a running word count.
+
+    Appending a section costs O(section): the word count is kept as a running
+    total and the joined text is rebuilt only when asked for, never by
+    re-splitting the whole document.
+    """
+
+    def __init__(self):
+        self.sections: list[str] = []
+        self.word_count = 0
+        self.target_words = 0  # planned length, set once the plan is known
+        self._text: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+    def append(self, section: str) -> None:
+        self.sections.append(section)
+        self._text = None
+        self.word_count += len(section.split())
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "".join(section + SECTION_SEPARATOR for section in self.sections)
+        return self._text
+
+
+class SectionRetriever:
+    """Section-specific RAG context, fetched ahead of the writer.
+
+    Plan steps are retrieved in windows of ``window`` steps with one
+    ``rag_engine.retrieve_batch`` call on the RAG loop, and asking for a
+    step's context also starts the next window, so retrieval runs while the
+    current sections are being written. Chunks retrieved for earlier sections
+    stay in a small LRU of chunk id -> text; a later section whose entities
+    were extracted from those chunks gets them as extra source text without
+    another lookup.
+    """
+
+    def __init__(
+        self,
+        steps: list[PlanStep],
+        topic: str,
+        window: int | None = None,
+        max_tokens: int | None = None,
+        cache_size: int | None = None,
+    ):
+        self.queries = [step.main_point for step in steps]
+        self.topic = topic
+        self.window = max(1, window or config.HANDBOOK_PREFETCH)
+        self.max_tokens = max_tokens or config.SECTION_CONTEXT_TOKENS
+        self.cache_size = cache_size or config.HANDBOOK_CHUNK_CACHE
+        self._windows: dict[int, concurrent.futures.Future] = {}
+        self._chunks: OrderedDict[str, tuple[str, int]] = OrderedDict()
+        self.stats = {"windows": 0, "failed_sections": 0, "reused_chunks": 0}
+
+    def prefetch(self, index: int) -> None:
+        """Start retrieval for the window containing step ``index``."""
+        number = index // self.window
+        first = number * self.window
+        if number in self._windows or first >= len(self.queries):
+            return
+        self._windows[number] = rag_engine.submit(
+            rag_engine.retrieve_batch(
+                self.queries[first:first + self.window],
+                max_tokens=self.max_tokens,
+                topic=self.topic,
+                priority="background",
+            )
+        )
+        self.stats["windows"] += 1
+
+    def _window(self, index: int) -> concurrent.futures.Future:
+        self.prefetch(index)
+        self.prefetch(index + self.window)
+        return self._windows[index // self.window]
+
+    def _render(self, index: int, future: concurrent.futures.Future) -> str:
+        try:
+            retrieval = future.result()[index % self.window]
+        except Exception:
+            # Retrieval is an enhancement; the section is written without it
+            self.stats["failed_sections"] += 1
+            return NO_SECTION_CONTEXT
+        own = {chunk_id for chunk_id, _, _ in retrieval.chunks}
+        extra = [
+            (chunk_id, *self._chunks[chunk_id])
+            for chunk_id in retrieval.linked_chunks
+            if chunk_id in self._chunks and chunk_id not in own
+        ]
+        self.stats["reused_chunks"] += len(extra)
+        for chunk_id, text, tokens in retrieval.chunks:
+            self._chunks[chunk_id] = (text, tokens)
+            self._chunks.move_to_end(chunk_id)
+        while len(self._chunks) > self.cache_size:
+            self._chunks.popitem(last=False)
+        return rag_engine.format_retrieval(retrieval, self.max_tokens, extra) or NO_SECTION_CONTEXT
+
+    def context(self, index: int) -> str:
+        """Context for step ``index``, waiting for its retrieval if needed."""
+        return self._render(index, self._window(index))
+
+    async def acontext(self, index: int) -> str:
+        """Async twin of context() that waits without blocking the loop."""
+        future = self._window(index)
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            pass  # reported by _render
+        return self._render(index, future)
+
+    def close(self) -> None:
+        for future in self._windows.values():
+            future.cancel()
+
+
+def _section_retriever(
+    steps: list[PlanStep], instruction: str, section_context: bool | None, start: int
+) -> SectionRetriever | None:
+    enabled = config.HANDBOOK_SECTION_CONTEXT if section_context is None else section_context
+    if not enabled or start >= len(steps):
+        return None
+    retriever = SectionRetriever(steps, instruction)
+    retriever.prefetch(start)
+    return retriever
+
+
+# Section summaries are written by the LLM in the background; a couple of
+# threads keep them off the writer's critical path in sync and async mode.
+_summary_pool: concurrent.futures.ThreadPoolExecutor | None = None
+
+
+def _get_summary_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _summary_pool
+    if _summary_pool is None:
+        _summary_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="handbook-summary"
+        )
+    return _summary_pool
+
+
+class _Summary:
+    """Summary of sections ``first..last`` (0-based): LLM text once ready, extractive until then."""
+
+    __slots__ = ("first", "last", "fallback", "future")
+
+    def __init__(self, first: int, last: int, fallback: str, future=None):
+        self.first = first
+        self.last = last
+        self.fallback = fallback
+        self.future = future
+
+    def text(self) -> str:
+        if self.future is not None and self.future.done() and not self.future.cancelled():
+            if self.future.exception() is None and self.future.result().strip():
+                return " ".join(self.future.result().split())
+        return self.fallback
+
+    def line(self) -> str:
+        label = f"Section {self.first + 1}" if self.first == self.last else f"Sections {self.first + 1}-{self.last + 1}"
+        return f"{label}: {self.text()}"
+
+
+class SectionMemory:
+    """Rolling, hierarchical summaries of the sections written so far.
+
+    Each appended section gets an extractive summary at once and an LLM
+    summary in the background. When more than ``slots`` summaries pile up,
+    the oldest ``merge`` are rolled up into one covering their whole range
+    (again by the LLM in the background), so the memory handed to the
+    writer stays about the same size however long the handbook grows.
+    """
+
+    def __init__(self, slots: int | None = None, merge: int = 4, words: int | None = None, use_llm: bool | None = None):
+        self.slots = max(2, slots or config.HANDBOOK_SUMMARY_SLOTS)
+        self.merge = max(2, merge)
+        self.words = words or config.HANDBOOK_SUMMARY_WORDS
+        self.use_llm = config.HANDBOOK_LLM_SUMMARIES if use_llm is None else use_llm
+        self.entries: list[_Summary] = []
+        self._deferred: list[tuple[_Summary, str]] | None = None  # LLM prompts held back by catch_up()
+
+    def __len__(self) -> int:
+        return self.entries[-1].last + 1 if self.entries else 0
+
+    def _submit(self, prompt: str):
+        if not self.use_llm:
+            return None
+        return _get_summary_pool().submit(
+            chat, prompt, max_tokens=self.words * 3, temperature=0.3, priority="background", task="chat"
+        )
+
+    def _entry(self, first: int, last: int, fallback: str, prompt: str) -> _Summary:
+        entry = _Summary(first, last, fallback)
+        if self._deferred is not None:
+            self._deferred.append((entry, prompt))
+        else:
+            entry.future = self._submit(prompt)
+        return entry
+
+    def add(self, index: int, section: str) -> None:
+        prompt = SUMMARY_PROMPT.format(words=self.words, text=section)
+        self.entries.append(self._entry(index, index, _summarize_section(section), prompt))
+        if len(self.entries) > self.slots:
+            self._roll_up()
+
+    def _roll_up(self) -> None:
+        group, self.entries = self.entries[:self.merge], self.entries[self.merge:]
+        texts = [entry.line() for entry in group]
+        fallback = " ".join(" ".join(entry.text() for entry in group).split()[:self.words])
+        for entry in group:
+            if entry.future is not None:
+                entry.future.cancel()  # a no-op once it has started
+        prompt = ROLLUP_PROMPT.format(words=self.words, summaries="\n".join(texts))
+        self.entries.insert(0, self._entry(group[0].first, group[-1].last, fallback, prompt))
+
+    def catch_up(self, document: HandbookDocument) -> None:
+        """Summarize sections that reached ``document`` without add(), e.g. on resume.
+
+        The replayed sections are rolled up first and only the summaries that
+        survive are sent to the LLM.
+        """
+        self._deferred = []
+        try:
+            for index in range(len(self), len(document)):
+                self.add(index, document.sections[index])
+        finally:
+            deferred, self._deferred = self._deferred, None
+        alive = {id(entry) for entry in self.entries}
+        for entry, prompt in deferred:
+            if id(entry) in alive:
+                entry.future = self._submit(prompt)
+
+    def lines(self) -> list[str]:
+        return [entry.line() for entry in self.entries]
+
+    def close(self) -> None:
+        for entry in self.entries:
+            if entry.future is not None:
+                entry.future.cancel()
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding("o200k_base")
+
+
+def _encode(text: str) -> list[int]:
+    return _encoding().encode(text, disallowed_special=())
+
+
+def _head(tokens: list[int], budget: int) -> str:
+    """Decode the first ``budget`` tokens, marking the cut."""
+    return _encoding().decode(tokens[:max(0, budget - 2)]) + " ..."
+
+
+class PromptBuilder:
+    """Writer prompts assembled inside a fixed token window.
+
+    The window (``config.HANDBOOK_PROMPT_TOKENS``) is split between the
+    instruction, the section's retrieved context, the plan and the section
+    summaries by PROMPT_SHARES; the verbatim end of the already written text
+    gets what is left (in parallel mode the summaries do), cut at a token
+    boundary. The instruction, plan lines and every written section are
+    encoded once and their tokens reused, so building a prompt costs about
+    one encode of the new context.
+    """
+
+    def __init__(self, instruction: str, steps: list[PlanStep], max_tokens: int | None = None):
+        self.max_tokens = max_tokens or config.HANDBOOK_PROMPT_TOKENS
+        self.instruction = instruction
+        self.steps = steps
+        self._lines = [step.line() for step in steps]
+        self._instruction_tokens = _encode(instruction)
+        self._step_tokens = [len(_encode(line)) + 1 for line in self._lines]  # + newline
+        self._section_tokens: list[list[int]] = []  # written sections, encoded once
+        self._template_tokens: dict[str, int] = {}
+        self.prompt_tokens: list[int] = []  # size of every prompt built, for reporting
+
+    def _fixed(self, template: str, step: str) -> int:
+        """Tokens of the template text plus the step itself."""
+        if template not in self._template_tokens:
+            slots = ("instruction", "plan", "text", "summaries", "siblings", "context", "step")
+            self._template_tokens[template] = len(_encode(template.format(**dict.fromkeys(slots, ""))))
+        return self._template_tokens[template] + len(_encode(step))
+
+    def _instruction(self, budget: int) -> tuple[str, int]:
+        tokens = self._instruction_tokens
+        if len(tokens) <= budget:
+            return self.instruction, len(tokens)
+        return _head(tokens, budget), budget
+
+    def _context(self, context: str, budget: int) -> tuple[str, int]:
+        tokens = _encode(context)
+        if len(tokens) <= budget:
+            return context, len(tokens)
+        return _head(tokens, budget), budget
+
+    def _plan(self, index: int, budget: int) -> tuple[str, int]:
+        """The whole plan, or the steps around ``index`` that fit ``budget``."""
+        if sum(self._step_tokens) <= budget:
+            return "\n".join(self._lines), sum(self._step_tokens)
+        keep, used = {index}, self._step_tokens[index]
+        # Nearest steps first, the next one ahead of the previous one
+        for distance in range(1, len(self.steps)):
+            for j in (index + distance, index - distance):
+                if 0 <= j < len(self.steps) and used + self._step_tokens[j] <= budget:
+                    keep.add(j)
+                    used += self._step_tokens[j]
+        lines, previous = [], -1
+        for j in sorted(keep):
+            if j != previous + 1:
+                lines.append("...")
+            lines.append(self._lines[j])
+            previous = j
+        if previous != len(self.steps) - 1:
+            lines.append("...")
+        return "\n".join(lines), used
+
+    def _recent_text(self, document: HandbookDocument, budget: int) -> tuple[str, int]:
+        """The end of ``document`` within ``budget`` tokens."""
+        if not document.sections:
+            return "(Beginning of document)", 0
+        for section in document.sections[len(self._section_tokens):]:
+            self._section_tokens.append(_encode(section + SECTION_SEPARATOR))
+        tail: list[int] = []
+        for tokens in reversed(self._section_tokens[:len(document.sections)]):
+            if len(tail) + len(tokens) > budget:
+                tail[:0] = tokens[len(tokens) - (budget - len(tail)):]
+                return "... " + _encoding().decode(tail), len(tail)
+            tail[:0] = tokens
+        return _encoding().decode(tail), len(tail)
+
+    def _summaries(self, summaries: list[str], budget: int) -> tuple[str, int]:
+        """The newest ``summaries`` that fit ``budget``, oldest first."""
+        kept, used = [], 0
+        for summary in reversed(summaries):
+            cost = len(_encode(summary)) + 1
+            if used + cost > budget:
+                break
+            kept.insert(0, summary)
+            used += cost
+        return ("\n".join(kept) if kept else "(Beginning of document)"), used
+
+    def _common(self, index: int, context: str, available: int) -> tuple[dict, int]:
+        instruction, used_instruction = self._instruction(int(available * PROMPT_SHARES["instruction"]))
+        context, used_context = self._context(context, int(available * PROMPT_SHARES["context"]))
+        plan, used_plan = self._plan(index, int(available * PROMPT_SHARES["plan"]))
+        parts = {"instruction": instruction, "context": context, "plan": plan, "step": self._lines[index]}
+        return parts, used_instruction + used_context + used_plan
+
+    def write_prompt(
+        self, index: int, document: HandbookDocument, context: str, summaries: list[str] = ()
+    ) -> str:
+        """WRITE_PROMPT for step ``index``: summaries plus the end of ``document``.
+
+        The verbatim tail is capped at ``config.HANDBOOK_TAIL_TOKENS``.
+        """
+        fixed = self._fixed(WRITE_PROMPT, self._lines[index])
+        available = max(0, self.max_tokens - fixed)
+        parts, used = self._common(index, context, available)
+        parts["summaries"], used_summaries = self._summaries(
+            list(summaries), int(available * PROMPT_SHARES["summaries"])
+        )
+        tail_budget = min(config.HANDBOOK_TAIL_TOKENS, available - used - used_summaries)
+        parts["text"], used_text = self._recent_text(document, tail_budget)
+        self.prompt_tokens.append(fixed + used + used_summaries + used_text)
+        return WRITE_PROMPT.format(**parts)
+
+    def parallel_prompt(self, index: int, summaries: list[str], siblings: str, context: str) -> str:
+        """PARALLEL_WRITE_PROMPT for step ``index``, keeping the newest summaries that fit."""
+        fixed = self._fixed(PARALLEL_WRITE_PROMPT, self._lines[index]) + len(_encode(siblings))
+        available = max(0, self.max_tokens - fixed)
+        parts, used = self._common(index, context, available)
+        parts["summaries"], used_summaries = self._summaries(summaries, available - used)
+        parts["siblings"] = siblings
+        self.prompt_tokens.append(fixed + used + used_summaries)
+        return PARALLEL_WRITE_PROMPT.format(**parts)
+
+
+class SectionLength(NamedTuple):
+    """How close one written section came to its step's word target."""
+
+    index: int
+    target_words: int
+    words: int
+    continuations: int
+    max_tokens: int  # output budget for the target when the section finished
+
+
+class SectionLengths:
+    """Per-section output budgets and length control.
+
+    ``max_tokens`` for a step is its word target times the tokens-per-word
+    ratio measured on the sections written so far (``config.
+    HANDBOOK_TOKENS_PER_WORD`` until the first one is in), plus
+    ``config.HANDBOOK_LENGTH_HEADROOM`` for the model to run a little long.
+    A section shorter than ``config.HANDBOOK_MIN_LENGTH`` of its target gets
+    up to ``config.HANDBOOK_MAX_CONTINUATIONS`` continuation calls sized for
+    the missing words. Every finished section is added to ``report``.
+    """
+
+    def __init__(
+        self,
+        tokens_per_word: float | None = None,
+        headroom: float | None = None,
+        min_length: float | None = None,
+        max_continuations: int | None = None,
+    ):
+        self.prior = tokens_per_word or config.HANDBOOK_TOKENS_PER_WORD
+        self.headroom = headroom or config.HANDBOOK_LENGTH_HEADROOM
+        self.min_length = config.HANDBOOK_MIN_LENGTH if min_length is None else min_length
+        self.max_continuations = (
+            config.HANDBOOK_MAX_CONTINUATIONS if max_continuations is None else max_continuations
+        )
+        self.report: list[SectionLength] = []
+        self._words = 0
+        self._tokens = 0
+
+    def tokens_per_word(self) -> float:
+        return self._tokens / self._words if self._words else self.prior
+
+    def max_tokens(self, words: int) -> int:
+        """Output budget for about ``words`` words."""
+        budget = int(words * self.tokens_per_word() * self.headroom) + 64
+        return min(max(budget, 256), config.HANDBOOK_MAX_SECTION_TOKENS)
+
+    def missing_words(self, step: PlanStep, text: str) -> int:
+        """Words still to write when ``text`` is too short for ``step``, else 0."""
+        words = len(text.split())
+        if words >= step.target_words * self.min_length:
+            return 0
+        return step.target_words - words
+
+    def continuation(self, step: PlanStep, text: str) -> tuple[str, int]:
+        """CONTINUE_PROMPT and its output budget for a section found too short."""
+        words = self.missing_words(step, text)
+        prompt = CONTINUE_PROMPT.format(step=step.line(), text=text.strip(), words=words)
+        return prompt, self.max_tokens(words)
+
+    def record(self, step: PlanStep, text: str, continuations: int) -> None:
+        words = len(text.split())
+        budget = self.max_tokens(step.target_words)
+        # Measure the ratio on whatever came back, so later budgets track the model
+        self._words += words
+        self._tokens += len(_encode(text))
+        self.report.append(SectionLength(step.index, step.target_words, words, continuations, budget))
+
+    def stats(self) -> dict:
+        """Length accuracy over the recorded sections."""
+        if not self.report:
+            return {"sections": 0}
+        errors = [abs(r.words - r.target_words) / r.target_words for r in self.report]
+        return {
+            "sections": len(self.report),
+            "target_words": sum(r.target_words for r in self.report),
+            "words": sum(r.words for r in self.report),
+            "within_20pct": sum(error <= 0.2 for error in errors),
+            "mean_abs_error": sum(errors) / len(errors),
+            "continuations": sum(r.continuations for r in self.report),
+            "tokens_per_word": round(self.tokens_per_word(), 3),
+        }
+
+
+# Section calls queue behind interactive chat in the llm_client scheduler
+_SECTION_OPTIONS = {"temperature": 0.7, "priority": "background"}
+
+
+def _write_section(prompt: str, step: PlanStep, lengths: SectionLengths) -> str:
+    """One section by chat(), continued while it is short of its target."""
+    text = chat(prompt, max_tokens=lengths.max_tokens(step.target_words), **_SECTION_OPTIONS)
+    continuations = 0
+    while continuations < lengths.max_continuations and lengths.missing_words(step, text):
+        more_prompt, max_tokens = lengths.continuation(step, text)
+        more = chat(more_prompt, max_tokens=max_tokens, **_SECTION_OPTIONS).strip()
+        continuations += 1
+        if not more:
+            break
+        text = text.rstrip() + SECTION_SEPARATOR + more
+    lengths.record(step, text, continuations)
+    return text
 
-def generate_plan(instruction: str, context: str) -> list[str]:
+
+def _stream_section(prompt: str, step: PlanStep, lengths: SectionLengths, parts: list[str]):
+    """Streaming _write_section(): yields chunks, leaving the section text in ``parts``."""
+    for chunk in chat_stream(prompt, max_tokens=lengths.max_tokens(step.target_words), **_SECTION_OPTIONS):
+        parts.append(chunk)
+        yield chunk
+    continuations = 0
+    while continuations < lengths.max_continuations and lengths.missing_words(step, "".join(parts)):
+        more_prompt, max_tokens = lengths.continuation(step, "".join(parts))
+        continuations += 1
+        separator = SECTION_SEPARATOR
+        for chunk in chat_stream(more_prompt, max_tokens=max_tokens, **_SECTION_OPTIONS):
+            if separator:
+                chunk = separator + chunk.lstrip()
+                separator = ""
+            parts.append(chunk)
+            yield chunk
+        if separator:
+            break  # empty continuation
+    lengths.record(step, "".join(parts), continuations)
+
+
+async def _awrite_section(prompt: str, step: PlanStep, lengths: SectionLengths) -> str:
+    """Async twin of _write_section()."""
+    text = await achat(prompt, max_tokens=lengths.max_tokens(step.target_words), **_SECTION_OPTIONS)
+    continuations = 0
+    while continuations < lengths.max_continuations and lengths.missing_words(step, text):
+        more_prompt, max_tokens = lengths.continuation(step, text)
+        more = (await achat(more_prompt, max_tokens=max_tokens, **_SECTION_OPTIONS)).strip()
+        continuations += 1
+        if not more:
+            break
+        text = text.rstrip() + SECTION_SEPARATOR + more
+    lengths.record(step, text, continuations)
+    return text
+
+
+async def _astream_section(prompt: str, step: PlanStep, lengths: SectionLengths, parts: list[str]):
+    """Async twin of _stream_section(); the section text is left in ``parts``."""
+    async for chunk in achat_stream(prompt, max_tokens=lengths.max_tokens(step.target_words), **_SECTION_OPTIONS):
+        parts.append(chunk)
+        yield chunk
+    continuations = 0
+    while continuations < lengths.max_continuations and lengths.missing_words(step, "".join(parts)):
+        more_prompt, max_tokens = lengths.continuation(step, "".join(parts))
+        continuations += 1
+        separator = SECTION_SEPARATOR
+        async for chunk in achat_stream(more_prompt, max_tokens=max_tokens, **_SECTION_OPTIONS):
+            if separator:
+                chunk = separator + chunk.lstrip()
+                separator = ""
+            parts.append(chunk)
+            yield chunk
+        if separator:
+            break  # empty continuation
+    lengths.record(step, "".join(parts), continuations)
+
+
+def generate_plan(instruction: str, context: str) -> list[PlanStep]:
     """Phase 1: Break instruction into paragraph-level subtasks."""
     prompt = PLAN_PROMPT.format(instruction=instruction, context=context)
     response = chat(prompt, max_tokens=4096, temperature=0.7)
-    steps = [line.strip() for line in response.strip().split("\n") if line.strip()]
-    return steps
+    return _parse_plan(response)
+
+
+async def agenerate_plan(instruction: str, context: str) -> list[PlanStep]:
+    """Async twin of generate_plan()."""
+    prompt = PLAN_PROMPT.format(instruction=instruction, context=context)
+    response = await achat(prompt, max_tokens=4096, temperature=0.7)
+    return _parse_plan(response)
+
+
+def _journal_plan(journal: HandbookJournal | None) -> list[PlanStep] | None:
+    """The plan of an interrupted run, re-parsed from its journalled lines."""
+    if journal is None or not journal.steps:
+        return None
+    return _parse_plan("\n".join(journal.steps)) or None
 
 
-def _get_recent_text(full_text: str, max_words: int = 3000) -> str:
-    """Get the last N words of the text to stay within reasonable prompt size."""
-    words = full_text.split()
-    if len(words) <= max_words:
-        return full_text
-    return "... " + " ".join(words[-max_words:])
+def _record_plan(journal: HandbookJournal | None, steps: list[PlanStep]) -> None:
+    if journal is not None:
+        journal.record_plan([step.line() for step in steps])
 
 
-def generate_handbook(instruction: str, context: str):
+def _status_line(steps: list[PlanStep], resumed: int) -> str:
+    total, words = len(steps), sum(step.target_words for step in steps)
+    if resumed:
+        return f"**Resuming handbook with {total} sections, ~{words:,} words ({resumed} already written).**\n\n"
+    return f"**Plan created with {total} sections, ~{words:,} words.** Starting generation...\n\n"
+
+
+def _replay_journal(
+    journal: HandbookJournal | None, document: HandbookDocument, total: int, stream: bool
+):
+    """Re-emit sections finished by an earlier run of the same instruction."""
+    if journal is None:
+        return
+    for i in range(journal.completed()):
+        section = journal.sections[i]
+        document.append(section)
+        yield i + 1, total, section
+        if stream:
+            yield i + 1, total, SECTION_SEPARATOR
+
+
+def _commit_section(
+    document: HandbookDocument,
+    journal: HandbookJournal | None,
+    memory: SectionMemory,
+    index: int,
+    section: str,
+) -> None:
+    document.append(section)
+    memory.add(index, section)
+    if journal is not None:
+        journal.record_section(index, section)
+
+
+def generate_handbook(
+    instruction: str,
+    context: str,
+    document: HandbookDocument | None = None,
+    stream: bool = False,
+    journal: HandbookJournal | None = None,
+    section_context: bool | None = None,
+    lengths: SectionLengths | None = None,
+):
     """Full AgentWrite pipeline: plan then write each paragraph sequentially.
 
-    Yields (step_num, total_steps, accumulated_text) tuples for progress updates.
+    Yields (step_num, total_steps, new_text) tuples for progress updates:
+    step 0 carries a status line, every later step the section just written.
+    Sections are appended to ``document`` so callers can read the running
+    word count and full text without re-accumulating the deltas.
+
+    With ``stream=True`` each section arrives as token chunks followed by a
+    SECTION_SEPARATOR, so the deltas of steps >= 1 concatenate to
+    ``document.text()``.
+
+    With a ``journal`` the plan and each finished section are persisted, and
+    a journal left behind by an interrupted run is resumed: its plan is
+    reused and its finished sections are replayed without LLM calls.
+
+    With ``section_context`` (default ``config.HANDBOOK_SECTION_CONTEXT``)
+    each section also gets source material retrieved for its own plan step
+    (see SectionRetriever); ``context`` only informs the plan.
+
+    Each section's ``max_tokens`` is sized from its step's word target, and
+    sections that come back short are continued (see SectionLengths); pass
+    ``lengths`` to read the per-section length report afterwards.
     """
-    # Phase 1: Planning
-    steps = generate_plan(instruction, context)
-    plan_text = "\n".join(steps)
+    document = document if document is not None else HandbookDocument()
+    lengths = lengths if lengths is not None else SectionLengths()
+
+    # Phase 1: Planning (skipped when resuming)
+    steps = _journal_plan(journal)
+    if steps is None:
+        steps = generate_plan(instruction, context)
+        _record_plan(journal, steps)
     total = len(steps)
+    document.target_words = sum(step.target_words for step in steps)
+    start = journal.completed() if journal is not None else 0
+
+    retriever = _section_retriever(steps, instruction, section_context, start)
+    prompts = PromptBuilder(instruction, steps)
+    memory = SectionMemory()
 
-    yield 0, total, f"**Plan created with {total} sections.** Starting generation...\n\n"
+    yield 0, total, _status_line(steps, start)
+    yield from _replay_journal(journal, document, total, stream)
+    memory.catch_up(document)
 
     # Phase 2: Writing (iterative, one paragraph at a time)
-    full_text = ""
-    for i, step in enumerate(steps):
-        recent_text = _get_recent_text(full_text) if full_text else "(Beginning of document)"
-        prompt = WRITE_PROMPT.format(
-            instruction=instruction,
-            plan=plan_text,
-            text=recent_text,
-            step=step,
-        )
-        paragraph = chat(prompt, max_tokens=4096, temperature=0.7)
-        full_text += paragraph + "\n\n"
+    try:
+        for i in range(start, total):
+            context = retriever.context(i) if retriever else NO_SECTION_CONTEXT
+            prompt = prompts.write_prompt(i, document, context, memory.lines())
+            if stream:
+                parts = []
+                for chunk in _stream_section(prompt, steps[i], lengths, parts):
+                    yield i + 1, total, chunk
+                _commit_section(document, journal, memory, i, "".join(parts))
+                yield i + 1, total, SECTION_SEPARATOR
+                continue
+
+            paragraph = _write_section(prompt, steps[i], lengths)
+            _commit_section(document, journal, memory, i, paragraph)
+
+            yield i + 1, total, paragraph
+    finally:
+        memory.close()
+        if retriever is not None:
+            retriever.close()
+
+    return document.text().strip()
+
+
+def _summarize_section(text: str, max_words: int = 60) -> str:
+    """Cheap extractive summary: section headings plus the first prose sentence."""
+    parts = []
+    headings = _HEADING_RE.findall(text)
+    if headings:
+        parts.append(" / ".join(headings[:3]))
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith(("#", "-", "*", "|", ">")):
+            sentence = _SENTENCE_RE.match(line)
+            parts.append(sentence.group(1) if sentence else line)
+            break
+    words = " — ".join(parts).split()
+    return " ".join(words[:max_words])
+
+
+def _plan_waves(start: int, total: int, wave_size: int) -> list[list[int]]:
+    """Group the consecutive step indices ``start..total-1`` into waves.
+
+    Every step depends only on the steps of earlier waves, so all steps of a
+    wave can be written concurrently once the previous wave has finished.
+    """
+    wave_size = max(1, wave_size)
+    return [list(range(first, min(first + wave_size, total))) for first in range(start, total, wave_size)]
+
+
+async def _awrite_parallel(
+    prompts: PromptBuilder,
+    memory: SectionMemory,
+    document: HandbookDocument,
+    journal: HandbookJournal | None,
+    concurrency: int,
+    wave_size: int,
+    stream: bool,
+    retriever: SectionRetriever | None,
+    lengths: SectionLengths,
+):
+    """Write steps wave by wave with at most ``concurrency`` calls in flight.
+
+    Sections are still yielded in plan order, as soon as each one and all of
+    its predecessors are done. Steps already in ``document`` are skipped.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    steps = prompts.steps
+    total = len(steps)
+
+    async def write(prompt: str, step: PlanStep) -> str:
+        async with semaphore:
+            return await _awrite_section(prompt, step, lengths)
+
+    for wave in _plan_waves(len(document), total, wave_size):
+        if retriever is not None:
+            contexts = await asyncio.gather(*(retriever.acontext(i) for i in wave))
+        else:
+            contexts = [NO_SECTION_CONTEXT] * len(wave)
+        summaries = memory.lines()
+        prompts_by_step = {}
+        for i, context in zip(wave, contexts):
+            siblings = "\n".join(steps[j].line() for j in wave if j != i) or "(none)"
+            prompts_by_step[i] = prompts.parallel_prompt(i, summaries, siblings, context)
+        # Longest sections first, so a wave wider than ``concurrency`` does not
+        # end waiting on one long section started last
+        tasks = {
+            i: asyncio.create_task(write(prompts_by_step[i], steps[i]))
+            for i in sorted(wave, key=lambda j: -steps[j].target_words)
+        }
+        try:
+            for i in wave:
+                paragraph = await tasks[i]
+                _commit_section(document, journal, memory, i, paragraph)
+                yield i + 1, total, paragraph
+                if stream:
+                    yield i + 1, total, SECTION_SEPARATOR
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+
+async def agenerate_handbook(
+    instruction: str,
+    context: str,
+    *,
+    document: HandbookDocument | None = None,
+    concurrency: int | None = None,
+    wave_size: int | None = None,
+    stream: bool = False,
+    journal: HandbookJournal | None = None,
+    section_context: bool | None = None,
+    lengths: SectionLengths | None = None,
+):
+    """Async twin of generate_handbook() for use inside an event loop.
+
+    Yields the same (step_num, total_steps, new_text) tuples, but awaits each
+    LLM call so other sessions keep being served meanwhile. With
+    ``concurrency`` > 1 (default ``config.HANDBOOK_CONCURRENCY``) the
+    sections of each wave are written in parallel; ``stream`` then delivers
+    whole sections, since later sections of a wave finish out of order.
+    """
+    document = document if document is not None else HandbookDocument()
+    lengths = lengths if lengths is not None else SectionLengths()
+    concurrency = concurrency or config.HANDBOOK_CONCURRENCY
+    wave_size = wave_size or config.HANDBOOK_WAVE_SIZE
+
+    steps = _journal_plan(journal)
+    if steps is None:
+        steps = await agenerate_plan(instruction, context)
+        _record_plan(journal, steps)
+    total = len(steps)
+    document.target_words = sum(step.target_words for step in steps)
+    start = journal.completed() if journal is not None else 0
+
+    retriever = _section_retriever(steps, instruction, section_context, start)
+    prompts = PromptBuilder(instruction, steps)
+    memory = SectionMemory()
+
+    yield 0, total, _status_line(steps, start)
+    for progress in _replay_journal(journal, document, total, stream):
+        yield progress
+    memory.catch_up(document)
+
+    try:
+        if concurrency > 1:
+            async for progress in _awrite_parallel(
+                prompts, memory, document, journal, concurrency, wave_size, stream, retriever, lengths
+            ):
+                yield progress
+            return
+
+        for i in range(start, total):
+            context = await retriever.acontext(i) if retriever else NO_SECTION_CONTEXT
+            prompt = prompts.write_prompt(i, document, context, memory.lines())
+            if stream:
+                parts = []
+                async for chunk in _astream_section(prompt, steps[i], lengths, parts):
+                    yield i + 1, total, chunk
+                _commit_section(document, journal, memory, i, "".join(parts))
+                yield i + 1, total, SECTION_SEPARATOR
+                continue
 
-        yield i + 1, total, full_text
+            paragraph = await _awrite_section(prompt, steps[i], lengths)
+            _commit_section(document, journal, memory, i, paragraph)
 
-    return full_text.strip()
+            yield i + 1, total, paragraph
+    finally:
+        memory.close()
+        if retriever is not None:
+            retriever.close()
@@ -0,0 +1,88 @@
+"""Append-only journal that makes handbook generation resumable.
+
+Brings the per-step ``write_cache.jsonl`` idea from
+LongWriter-main/agentwrite/write.py into the app: the plan and every finished
+section are appended as JSON lines under ``RAG_WORKING_DIR/handbook_runs/``,
+so a crashed or resubmitted run picks up after the last completed step
+instead of paying for every LLM call again.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from app import config
+
+
+def run_id(instruction: str) -> str:
+    """Identify a generation run by its (whitespace/case-normalized) instruction."""
+    normalized = " ".join(instruction.lower().split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+class HandbookJournal:
+    """Plan and completed sections of one handbook run, persisted as JSONL."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.steps: list[str] | None = None
+        self.sections: dict[int, str] = {}
+        self._load()
+
+    @classmethod
+    def for_instruction(cls, instruction: str, directory: str | Path | None = None) -> "HandbookJournal":
+        directory = Path(directory or Path(config.RAG_WORKING_DIR) / "handbook_runs")
+        return cls(directory / f"{run_id(instruction)}.jsonl")
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        kept = 0  # bytes of complete entries
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated line")
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn final write from a crash; ignore the rest
+                if entry["type"] == "plan":
+                    self.steps = entry["steps"]
+                    self.sections.clear()
+                elif entry["type"] == "section":
+                    self.sections[entry["index"]] = entry["text"]
+                kept += len(line)
+        if kept < self.path.stat().st_size:
+            # Cut the torn tail off so the next entry starts on a line of its own
+            with open(self.path, "r+b") as f:
+                f.truncate(kept)
+
+    def _append(self, entry: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_plan(self, steps: list[str]) -> None:
+        self.steps = list(steps)
+        self.sections.clear()
+        self._append({"type": "plan", "steps": self.steps})
+
+    def record_section(self, index: int, text: str) -> None:
+        self.sections[index] = text
+        self._append({"type": "section", "index": index, "text": text})
+
+    def completed(self) -> int:
+        """Number of consecutive sections finished from the start of the plan."""
+        count = 0
+        while count in self.sections:
+            count += 1
+        return count
+
+    def finish(self) -> None:
+        """Drop the journal once the handbook has been saved."""
+        self.path.unlink(missing_ok=True)
+        self.steps = None
+        self.sections.clear()
@@ -0,0 +1,153 @@
+"""Staged, concurrent ingestion of uploaded PDFs into LightRAG.
+
+Extraction workers stream token-bounded chunks from ``pdf_processor`` into a
+bounded queue, and a single inserter drains it in batches through
+``LightRAG.ainsert``. A full queue blocks extraction (backpressure), so
+CPU-bound extraction of one file overlaps with network-bound indexing of
+another while memory stays bounded.
+"""
+
+import asyncio
+import time
+from pathlib import Path
+
+from app import config, rag_engine
+from app.pdf_processor import file_digest, iter_chunks
+
+_STOP = object()
+
+
+class FileIngest:
+    """Progress and outcome of one file moving through the pipeline."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.name = self.path.name
+        self.digest: str | None = None
+        self.chunks_extracted = 0
+        self.chunks_inserted = 0
+        self.pages = 0
+        self.tokens = 0
+        self.words = 0
+        self.skipped = False
+        self.done = False
+        self.error: str | None = None
+        self.started = time.monotonic()
+        self.seconds = 0.0
+
+    def status_line(self) -> str:
+        if self.error:
+            return f"{self.name}: failed ({self.error})"
+        if self.skipped:
+            return f"{self.name}: already indexed ({self.seconds:.0f} s)"
+        return f"{self.name}: {self.words:,} words indexed ({self.pages} pages, {self.seconds:.0f} s)"
+
+
+async def ingest_files(paths: list[str | Path], on_progress=None) -> list[FileIngest]:
+    """Extract and index ``paths`` concurrently; returns one FileIngest per path.
+
+    ``on_progress(file_ingest)`` is called whenever a batch containing the
+    file was inserted and once more when the file is finished.
+    """
+    files = [FileIngest(p) for p in paths]
+    pending_files: asyncio.Queue = asyncio.Queue()
+    for item in files:
+        pending_files.put_nowait(item)
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=max(1, config.INGEST_QUEUE_CHUNKS))
+
+    def notify(item: FileIngest) -> None:
+        if on_progress is not None:
+            on_progress(item)
+
+    def finish(item: FileIngest) -> None:
+        item.done = True
+        item.seconds = time.monotonic() - item.started
+        notify(item)
+
+    async def extract(item: FileIngest) -> None:
+        item.started = time.monotonic()
+        try:
+            item.digest = await asyncio.to_thread(file_digest, item.path)
+            item.skipped = rag_engine.is_indexed(item.digest)
+            if not item.skipped:
+                iterator = iter_chunks(item.path, digest=item.digest)
+                while (chunk := await asyncio.to_thread(next, iterator, None)) is not None:
+                    item.chunks_extracted += 1
+                    await chunks.put((item, chunk))  # blocks while the inserter is behind
+        except Exception as e:
+            item.error = f"extraction error: {e}"
+        if item.skipped:
+            finish(item)
+        else:
+            await chunks.put((item, None))  # end-of-file marker, after all its chunks
+
+    async def extractor() -> None:
+        while True:
+            try:
+                item = pending_files.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await extract(item)
+
+    async def insert(batch: list[tuple[FileIngest, object]]) -> None:
+        batch = [(item, chunk) for item, chunk in batch if item.error is None]
+        if not batch:
+            return
+        try:
+            await rag_engine.insert_batch(
+                [chunk.text for _, chunk in batch],
+                [f"{item.name} (pages {chunk.first_page}-{chunk.last_page})" for item, chunk in batch],
+            )
+        except Exception as e:
+            for item, _ in batch:
+                item.error = f"indexing error: {e}"
+            return
+        for item, chunk in batch:
+            item.chunks_inserted += 1
+            item.pages = chunk.last_page
+            item.tokens += chunk.tokens
+            item.words += len(chunk.text.split())
+        for item in {item for item, _ in batch}:
+            notify(item)
+
+    async def inserter() -> None:
+        while True:
+            entries = [await chunks.get()]
+            # Take whatever else is already waiting, up to one batch
+            while len(entries) < config.INGEST_BATCH_SIZE and not chunks.empty():
+                entries.append(chunks.get_nowait())
+            stop = _STOP in entries
+            entries = [e for e in entries if e is not _STOP]
+            await insert([(item, chunk) for item, chunk in entries if chunk is not None])
+            for item, chunk in entries:
+                if chunk is None:
+                    if item.error is None:
+                        rag_engine.mark_indexed(
+                            item.digest, name=item.name, pages=item.pages,
+                            tokens=item.tokens, words=item.words,
+                        )
+                    finish(item)
+            if stop:
+                return
+
+    async def unless_inserter_fails(step) -> None:
+        # Nobody drains the queue once the inserter is gone: stop waiting on it
+        step = asyncio.ensure_future(step)
+        await asyncio.wait({step, inserter_task}, return_when=asyncio.FIRST_COMPLETED)
+        if not step.done():
+            step.cancel()
+            await asyncio.gather(step, return_exceptions=True)
+            inserter_task.result()  # re-raises the inserter's error
+        step.result()
+
+    inserter_task = asyncio.create_task(inserter())
+    extractors = [asyncio.create_task(extractor()) for _ in range(max(1, config.INGEST_EXTRACT_WORKERS))]
+    try:
+        await unless_inserter_fails(asyncio.gather(*extractors))
+        await unless_inserter_fails(chunks.put(_STOP))
+        await inserter_task
+    finally:
+        for task in (*extractors, inserter_task):
+            task.cancel()
+        await asyncio.gather(*extractors, inserter_task, return_exceptions=True)
+    return files
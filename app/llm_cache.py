@@ -0,0 +1,255 @@
+"""Opt-in, disk-backed cache for LLM responses.
+
+Entries live in a small SQLite file keyed by a hash of the request. The cache
+is size-bounded with least-recently-used eviction and an optional TTL, and
+concurrent identical non-streaming requests share a single upstream call.
+Async callers run the SQLite work in a worker thread, off the event loop.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+# Cached streams are replayed in pieces of this many characters
+REPLAY_CHUNK_CHARS = 64
+
+
+def request_key(model: str, messages: list[dict], temperature: float, max_tokens: int, **extra) -> str:
+    """Stable hash of everything that determines an LLM response."""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        **{k: v for k, v in extra.items() if v is not None},
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _replay(text: str):
+    for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+        yield text[i:i + REPLAY_CHUNK_CHARS]
+
+
+class ResponseCache:
+    """SQLite response store with LRU size bound, TTL and single-flight."""
+
+    def __init__(self, path: str | Path, max_bytes: int, ttl: float = 0.0):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+        self._lock = threading.Lock()
+        self._inflight: dict[str, Future] = {}
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    # ------------------------------------------------------------------ #
+    #  Storage                                                             #
+    # ------------------------------------------------------------------ #
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, size, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            value, size, created = row
+            if self.ttl and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self._total_bytes -= size
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._total_bytes -= old[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._total_bytes += size
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache fits. Lock held."""
+        while self._total_bytes > self.max_bytes:
+            row = self._db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self._total_bytes -= row[1]
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+            self._total_bytes = 0
+
+    def info(self) -> dict:
+        """Counters plus current size, for logging or a status line."""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": entries,
+                "bytes": self._total_bytes,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
+
+    # ------------------------------------------------------------------ #
+    #  Single-flight                                                       #
+    # ------------------------------------------------------------------ #
+
+    def _claim(self, key: str) -> Future | None:
+        """Become the leader for ``key``, or return the running leader's future."""
+        with self._lock:
+            leader = self._inflight.get(key)
+            if leader is not None:
+                self.stats["coalesced"] += 1
+                return leader
+            self._inflight[key] = Future()
+            return None
+
+    def _lead(self, key: str) -> bool:
+        """Become the leader for ``key`` unless a call for it is already running."""
+        with self._lock:
+            if key in self._inflight:
+                return False
+            self._inflight[key] = Future()
+            return True
+
+    def _publish(self, key: str, value: str | None) -> None:
+        """Hand the leader's result to followers; None tells them to call upstream themselves."""
+        with self._lock:
+            future = self._inflight.pop(key)
+        future.set_result(value)
+
+    def _release(self, key: str, value: str | None, keep=None) -> None:
+        """Store the leader's result, if ``keep()`` allows, then publish it.
+
+        Followers get the result whether or not it is stored.
+        """
+        try:
+            if value is not None and (keep is None or keep()):
+                self.put(key, value)
+        finally:
+            self._publish(key, value)
+
+    async def _arelease(self, key: str, value: str | None, keep=None) -> None:
+        """Async twin of _release(); SQLite runs in a worker thread."""
+        try:
+            if value is not None and (keep is None or keep()):
+                await asyncio.to_thread(self.put, key, value)
+        finally:
+            self._publish(key, value)
+
+    def get_or_compute(self, key: str, compute, keep=None) -> str:
+        value = self.get(key)
+        if value is not None:
+            return value
+        leader = self._claim(key)
+        if leader is not None:
+            value = leader.result()
+            return value if value is not None else compute()
+        value = None
+        try:
+            value = compute()
+            return value
+        finally:
+            self._release(key, value, keep)
+
+    async def aget_or_compute(self, key: str, compute, keep=None) -> str:
+        """Async twin of get_or_compute(); SQLite runs off the event loop."""
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            return value
+        leader = self._claim(key)
+        if leader is not None:
+            value = await asyncio.wrap_future(leader)
+            return value if value is not None else await compute()
+        value = None
+        try:
+            value = await compute()
+            return value
+        finally:
+            await self._arelease(key, value, keep)
+
+    def stream(self, key: str, open_stream, keep=None):
+        """Yield a cached response in chunks, or stream and record it.
+
+        Streams are not coalesced: while an identical request is already
+        streaming, this one streams from upstream too (uncached) rather than
+        waiting for the other to finish.
+        """
+        value = self.get(key)
+        if value is not None:
+            yield from _replay(value)
+            return
+        if not self._lead(key):
+            yield from open_stream()
+            return
+        parts = []
+        complete = False
+        try:
+            for chunk in open_stream():
+                parts.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            # An abandoned or failed stream is not cached
+            self._release(key, "".join(parts) if complete else None, keep)
+
+    async def astream(self, key: str, open_stream, keep=None):
+        """Async twin of stream()."""
+        value = await asyncio.to_thread(self.get, key)
+        if value is not None:
+            for chunk in _replay(value):
+                yield chunk
+            return
+        if not self._lead(key):
+            async for chunk in open_stream():
+                yield chunk
+            return
+        parts = []
+        complete = False
+        try:
+            async for chunk in open_stream():
+                parts.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            await self._arelease(key, "".join(parts) if complete else None, keep)
@@ -1,60 +1,423 @@
-"""Grok 4.1 LLM client using OpenAI-compatible API."""
+"""Grok 4.1 LLM client using OpenAI-compatible API.
 
-from openai import OpenAI
-from app.config import XAI_API_KEY, XAI_BASE_URL, GROK_MODEL
+Calls are routed across the configured backends (Grok plus any in
+``config.LLM_BACKENDS``) by ``llm_router`` and admitted, rate-limited and
+retried per backend by ``llm_scheduler``.
+"""
 
+import asyncio
+import threading
+import weakref
 
-def get_client() -> OpenAI:
-    return OpenAI(api_key=XAI_API_KEY, base_url=XAI_BASE_URL)
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 
+from app import config
+from app.llm_cache import ResponseCache, request_key
+from app.llm_router import TASKS, Backend, LLMRouter
+from app.llm_scheduler import RequestScheduler
 
-def chat(
-    prompt: str,
-    *,
-    system: str | None = None,
-    model: str = GROK_MODEL,
-    max_tokens: int = 4096,
-    temperature: float = 0.7,
-) -> str:
-    """Send a single-turn chat request to Grok and return the response text."""
-    client = get_client()
+
+# Process-wide client registry keyed by (base_url, api_key). Each client owns
+# a keep-alive connection pool, so repeated calls reuse warm connections.
+_clients: dict[tuple[str, str], OpenAI] = {}
+# Async clients are bound to the event loop their connections were opened on,
+# so they are registered per loop: {loop: {(base_url, api_key): AsyncOpenAI}}.
+_async_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+# Opt-in response cache, created on first use when enabled
+_cache: ResponseCache | None = None
+# Backends with their schedulers (admission, rate limits, retries)
+_router: LLMRouter | None = None
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_client(api_key: str | None = None, base_url: str | None = None) -> OpenAI:
+    """Return the shared sync client for this endpoint, creating it on first use."""
+    api_key = api_key or config.XAI_API_KEY
+    base_url = base_url or config.XAI_BASE_URL
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    max_retries=0,  # retried by the scheduler
+                    http_client=DefaultHttpxClient(limits=_pool_limits()),
+                )
+                _clients[key] = client
+    return client
+
+
+def get_async_client(api_key: str | None = None, base_url: str | None = None) -> AsyncOpenAI:
+    """Return the shared async client for this endpoint on the running event loop."""
+    api_key = api_key or config.XAI_API_KEY
+    base_url = base_url or config.XAI_BASE_URL
+    loop = asyncio.get_running_loop()
+    key = (base_url, api_key)
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,  # retried by the scheduler
+                http_client=DefaultAsyncHttpxClient(limits=_pool_limits()),
+            )
+            per_loop[key] = client
+    return client
+
+
+def close_clients() -> None:
+    """Close all pooled sync clients and forget every registered client.
+
+    The router and its schedulers are dropped too, so the next call picks
+    up the current backend and rate-limit settings.
+    """
+    global _router
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _async_clients.clear()
+        _router = None
+
+
+def _build_messages(prompt: str, system: str | None, history: list[dict] | None = None) -> list[dict]:
     messages = []
     if system:
         messages.append({"role": "system", "content": system})
+    messages.extend(history or [])
     messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def get_cache() -> ResponseCache | None:
+    """Return the shared response cache, or None unless LLM_CACHE_ENABLED."""
+    global _cache
+    if not config.LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    config.LLM_CACHE_PATH,
+                    max_bytes=int(config.LLM_CACHE_MAX_MB * 1024 * 1024),
+                    ttl=config.LLM_CACHE_TTL,
+                )
+    return _cache
+
+
+def cache_stats() -> dict:
+    """Hit/miss counters of the response cache (empty when disabled)."""
+    cache = get_cache()
+    return cache.info() if cache is not None else {}
+
+
+def _backend(settings: dict) -> Backend:
+    scheduler = RequestScheduler(
+        rpm=settings["rpm"],
+        tpm=settings["tpm"],
+        max_inflight=settings["max_inflight"] or config.LLM_MAX_CONNECTIONS,
+        max_retries=config.LLM_MAX_RETRIES,
+        backoff_base=config.LLM_BACKOFF_BASE,
+        backoff_max=config.LLM_BACKOFF_MAX,
+        lanes=config.LLM_PRIORITY_LANES,
+    )
+    tasks = tuple(task for task in settings["tasks"] if task in TASKS)
+    return Backend(
+        settings["name"], settings["base_url"], settings["api_key"], settings["model"], tasks, scheduler
+    )
+
+
+def get_router() -> LLMRouter:
+    """Return the shared backend router, creating it from config on first use."""
+    global _router
+    if _router is None:
+        with _lock:
+            if _router is None:
+                _router = LLMRouter(
+                    [_backend(settings) for settings in config.llm_backends()],
+                    alpha=config.LLM_EWMA_ALPHA,
+                    slow_factor=config.LLM_SLOW_FACTOR,
+                    unhealthy_error_rate=config.LLM_UNHEALTHY_ERROR_RATE,
+                    cooldown=config.LLM_BACKEND_COOLDOWN,
+                    failover_retries=config.LLM_FAILOVER_RETRIES,
+                    hedge_tasks=config.LLM_HEDGE_TASKS,
+                    hedge_factor=config.LLM_HEDGE_FACTOR,
+                    hedge_min_delay=config.LLM_HEDGE_MIN_DELAY,
+                )
+    return _router
 
-    resp = client.chat.completions.create(
-        model=model,
+
+def scheduler_stats() -> dict:
+    """Admission, retry and deadline counters, summed over all backends."""
+    totals: dict = {}
+    for backend in get_router().backends:
+        for name, value in backend.scheduler.stats.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def router_stats() -> dict:
+    """Per-backend health, latency and failover/hedge counters."""
+    return get_router().stats()
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _task(task: str | None, priority: str) -> str:
+    """The routing task: given, or long writing for background calls and chat otherwise."""
+    return task or ("long_writing" if priority == "background" else "chat")
+
+
+def _schedule(messages: list[dict], max_tokens: int, priority: str, timeout: float | None) -> dict:
+    """Scheduler arguments for one request: lane, token reservation, deadline."""
+    prompt_tokens = sum(_estimate_tokens(str(m.get("content") or "")) for m in messages)
+    if timeout is None:
+        timeout = config.LLM_BACKGROUND_TIMEOUT if priority == "background" else config.LLM_TIMEOUT
+    return {
+        "lane": priority,
+        "tokens": prompt_tokens + max_tokens,
+        "timeout": timeout,
+        "cost": lambda text: prompt_tokens + _estimate_tokens(text),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Uncached upstream calls
+# ---------------------------------------------------------------------------
+
+def _complete(
+    backend: Backend, messages: list[dict], model: str | None, max_tokens: int, temperature: float, timeout: float
+) -> str:
+    resp = get_client(backend.api_key, backend.base_url).chat.completions.create(
+        model=model or backend.model,
         messages=messages,
         max_tokens=max_tokens,
         temperature=temperature,
+        timeout=timeout,
     )
     return resp.choices[0].message.content or ""
 
 
-def chat_stream(
-    prompt: str,
-    *,
-    system: str | None = None,
-    model: str = GROK_MODEL,
-    max_tokens: int = 4096,
-    temperature: float = 0.7,
+def _complete_stream(
+    backend: Backend, messages: list[dict], model: str | None, max_tokens: int, temperature: float, timeout: float
 ):
-    """Stream a chat response from Grok, yielding text chunks."""
-    client = get_client()
-    messages = []
-    if system:
-        messages.append({"role": "system", "content": system})
-    messages.append({"role": "user", "content": prompt})
-
-    stream = client.chat.completions.create(
-        model=model,
+    stream = get_client(backend.api_key, backend.base_url).chat.completions.create(
+        model=model or backend.model,
         messages=messages,
         max_tokens=max_tokens,
         temperature=temperature,
         stream=True,
+        timeout=timeout,
     )
     for chunk in stream:
-        delta = chunk.choices[0].delta.content
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
+
+
+async def _acomplete(
+    backend: Backend,
+    messages: list[dict],
+    model: str | None,
+    max_tokens: int,
+    temperature: float,
+    response_format: dict | None,
+    timeout: float,
+) -> str:
+    extra = {"response_format": response_format} if response_format else {}
+    resp = await get_async_client(backend.api_key, backend.base_url).chat.completions.create(
+        model=model or backend.model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        timeout=timeout,
+        **extra,
+    )
+    return resp.choices[0].message.content or ""
+
+
+async def _acomplete_stream(
+    backend: Backend, messages: list[dict], model: str | None, max_tokens: int, temperature: float, timeout: float
+):
+    stream = await get_async_client(backend.api_key, backend.base_url).chat.completions.create(
+        model=model or backend.model,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True,
+        timeout=timeout,
+    )
+    async for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
         if delta:
             yield delta
+
+
+# ---------------------------------------------------------------------------
+# Public API (cache-aware)
+# ---------------------------------------------------------------------------
+
+def chat(
+    prompt: str,
+    *,
+    system: str | None = None,
+    model: str | None = None,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    priority: str = "interactive",
+    timeout: float | None = None,
+    task: str | None = None,
+) -> str:
+    """Send a single-turn chat request and return the response text.
+
+    ``priority`` picks the scheduler lane ("interactive" or "background");
+    ``timeout`` is the deadline in seconds for queueing, retries, failover
+    and the request together (default ``config.LLM_TIMEOUT``, or
+    ``config.LLM_BACKGROUND_TIMEOUT`` for background calls). ``task``
+    ("chat", "extraction", "long_writing") picks the backends; it defaults
+    to long writing for background calls and chat otherwise. ``model``
+    overrides the backend's model.
+    """
+    task = _task(task, priority)
+    messages = _build_messages(prompt, system)
+    schedule = _schedule(messages, max_tokens, priority, timeout)
+    # Cached under the preferred backend's model, so failover answers are not stored
+    preferred, answered = get_router().preferred(task), []
+
+    def compute() -> str:
+        return get_router().run(
+            task,
+            lambda b, t: _complete(b, messages, model, max_tokens, temperature, t),
+            served=answered.append,
+            **schedule,
+        )
+
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    key = request_key(model or preferred.model, messages, temperature, max_tokens)
+    return cache.get_or_compute(key, compute, keep=lambda: answered == [preferred])
+
+
+def chat_stream(
+    prompt: str,
+    *,
+    system: str | None = None,
+    model: str | None = None,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    priority: str = "interactive",
+    timeout: float | None = None,
+    task: str | None = None,
+):
+    """Stream a chat response, yielding text chunks.
+
+    The ``timeout`` deadline covers the wait for the first chunk.
+    """
+    task = _task(task, priority)
+    messages = _build_messages(prompt, system)
+    schedule = _schedule(messages, max_tokens, priority, timeout)
+    preferred, answered = get_router().preferred(task), []
+
+    def compute():
+        return get_router().stream(
+            task,
+            lambda b, t: _complete_stream(b, messages, model, max_tokens, temperature, t),
+            served=answered.append,
+            **schedule,
+        )
+
+    cache = get_cache()
+    if cache is None:
+        yield from compute()
+        return
+    key = request_key(model or preferred.model, messages, temperature, max_tokens)
+    yield from cache.stream(key, compute, keep=lambda: answered == [preferred])
+
+
+async def achat(
+    prompt: str,
+    *,
+    system: str | None = None,
+    history: list[dict] | None = None,
+    model: str | None = None,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    response_format: dict | None = None,
+    priority: str = "interactive",
+    timeout: float | None = None,
+    task: str | None = None,
+) -> str:
+    """Async twin of chat(); awaits the response without blocking the event loop."""
+    task = _task(task, priority)
+    messages = _build_messages(prompt, system, history)
+    schedule = _schedule(messages, max_tokens, priority, timeout)
+    preferred, answered = get_router().preferred(task), []
+
+    async def compute() -> str:
+        return await get_router().arun(
+            task,
+            lambda b, t: _acomplete(b, messages, model, max_tokens, temperature, response_format, t),
+            served=answered.append,
+            **schedule,
+        )
+
+    cache = get_cache()
+    if cache is None:
+        return await compute()
+    key = request_key(
+        model or preferred.model, messages, temperature, max_tokens, response_format=response_format
+    )
+    return await cache.aget_or_compute(key, compute, keep=lambda: answered == [preferred])
+
+
+async def achat_stream(
+    prompt: str,
+    *,
+    system: str | None = None,
+    history: list[dict] | None = None,
+    model: str | None = None,
+    max_tokens: int = 4096,
+    temperature: float = 0.7,
+    priority: str = "interactive",
+    timeout: float | None = None,
+    task: str | None = None,
+):
+    """Async twin of chat_stream(), yielding text chunks as they arrive."""
+    task = _task(task, priority)
+    messages = _build_messages(prompt, system, history)
+    schedule = _schedule(messages, max_tokens, priority, timeout)
+    preferred, answered = get_router().preferred(task), []
+
+    def compute():
+        return get_router().astream(
+            task,
+            lambda b, t: _acomplete_stream(b, messages, model, max_tokens, temperature, t),
+            served=answered.append,
+            **schedule,
+        )
+
+    cache = get_cache()
+    if cache is None:
+        async for chunk in compute():
+            yield chunk
+        return
+    key = request_key(model or preferred.model, messages, temperature, max_tokens)
+    async for chunk in cache.astream(key, compute, keep=lambda: answered == [preferred]):
+        yield chunk
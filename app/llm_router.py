@@ -0,0 +1,324 @@
+"""Routing of LLM calls across several OpenAI-compatible backends.
+
+Each Backend is one endpoint and model (Grok, a local vLLM or llama.cpp
+server, ...) with the tasks it serves ("chat", "extraction",
+"long_writing"), its own RequestScheduler (rate limits are per provider) and
+health: an EWMA of latency per task and an EWMA of its error rate.
+
+For every call the router orders the backends serving the task: healthy
+before unhealthy (error rate above the threshold, until a cooldown has
+passed since the last failure), then configured order, except that a
+backend more than ``slow_factor`` times slower than the fastest one on this
+task moves behind it. The call goes to the first backend, with at most
+``failover_retries`` retries; a failure that another backend could survive
+(connection errors, timeouts, 429, 5xx) moves on to the next one. For tasks
+in ``hedge_tasks``, an async call still unanswered after ``hedge_factor``
+times its backend's EWMA latency also starts on the next backend, and the
+first answer wins.
+"""
+
+import asyncio
+import time
+
+import openai
+
+from app.llm_scheduler import RequestScheduler
+
+TASKS = ("chat", "extraction", "long_writing")
+
+
+class Backend:
+    """One OpenAI-compatible endpoint, the tasks it serves and its observed health."""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        api_key: str,
+        model: str,
+        tasks: tuple[str, ...],
+        scheduler: RequestScheduler,
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.tasks = tasks
+        self.scheduler = scheduler
+        self.latency: dict[str, float] = {}  # task -> EWMA seconds
+        self.error_rate = 0.0  # EWMA of failures (1) and successes (0)
+        self.failed_at = 0.0
+        self.stats = {"calls": 0, "failures": 0, "hedges": 0}
+
+    def observe(self, task: str, seconds: float | None, alpha: float) -> None:
+        """Record one call: its latency, or None when it failed."""
+        self.stats["calls"] += 1
+        if seconds is None:
+            self.stats["failures"] += 1
+            self.failed_at = time.monotonic()
+            self.error_rate += alpha * (1 - self.error_rate)
+            return
+        self.error_rate -= alpha * self.error_rate
+        previous = self.latency.get(task)
+        self.latency[task] = seconds if previous is None else previous + alpha * (seconds - previous)
+
+
+def _fail_over(exc: BaseException) -> bool:
+    """Whether another backend might succeed where this one failed."""
+    if isinstance(exc, openai.BadRequestError):
+        return False  # the request itself is at fault
+    return isinstance(exc, (openai.APIError, TimeoutError))
+
+
+class LLMRouter:
+    """Task-based routing with latency tracking, failover and hedging."""
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        alpha: float = 0.2,
+        slow_factor: float = 2.0,
+        unhealthy_error_rate: float = 0.5,
+        cooldown: float = 30.0,
+        failover_retries: int = 0,
+        hedge_tasks: tuple[str, ...] = ("chat", "extraction"),
+        hedge_factor: float = 3.0,
+        hedge_min_delay: float = 1.0,
+    ):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.alpha = alpha
+        self.slow_factor = slow_factor
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self.cooldown = cooldown
+        self.failover_retries = failover_retries
+        self.hedge_tasks = hedge_tasks
+        self.hedge_factor = hedge_factor
+        self.hedge_min_delay = hedge_min_delay
+
+    def _serving(self, task: str) -> list[Backend]:
+        serving = [b for b in self.backends if task in b.tasks]
+        if not serving:
+            raise ValueError(f"No LLM backend serves the {task!r} task")
+        return serving
+
+    def preferred(self, task: str) -> Backend:
+        """The configured first choice for ``task``, regardless of health."""
+        return self._serving(task)[0]
+
+    def _unhealthy(self, backend: Backend, now: float) -> bool:
+        return (
+            backend.error_rate > self.unhealthy_error_rate
+            and now - backend.failed_at < self.cooldown
+        )
+
+    def route(self, task: str) -> list[Backend]:
+        """Backends serving ``task``, best first."""
+        now = time.monotonic()
+        serving = self._serving(task)
+        known = [b.latency[task] for b in serving if task in b.latency and not self._unhealthy(b, now)]
+        fastest = min(known) if known else None
+
+        def key(indexed: tuple[int, Backend]):
+            index, backend = indexed
+            slow = fastest is not None and backend.latency.get(task, fastest) > fastest * self.slow_factor
+            return (self._unhealthy(backend, now), slow, index)
+
+        return [backend for _, backend in sorted(enumerate(serving), key=key)]
+
+    def _hedge_delay(self, backend: Backend, task: str) -> float | None:
+        latency = backend.latency.get(task)
+        if task not in self.hedge_tasks or latency is None:
+            return None
+        return max(self.hedge_min_delay, latency * self.hedge_factor)
+
+    def _retries(self, backends: list[Backend], backend: Backend) -> int | None:
+        # The last resort gets the scheduler's full retries, the others fail over fast
+        return None if backend is backends[-1] else self.failover_retries
+
+    # ------------------------------------------------------------------ #
+    #  Calls                                                               #
+    # ------------------------------------------------------------------ #
+
+    def run(self, task: str, request, *, timeout: float, served=None, **schedule):
+        """Call ``request(backend, timeout)`` on the best backend, failing over on errors.
+
+        ``schedule`` holds the RequestScheduler.run() arguments besides
+        ``timeout``, which is one deadline shared by all attempts.
+        ``served(backend)``, if given, is told which backend answered.
+        """
+        deadline = time.monotonic() + timeout
+        backends = self.route(task)
+        for backend in backends:
+            started = time.monotonic()
+            try:
+                result = backend.scheduler.run(
+                    lambda t, b=backend: request(b, t),
+                    timeout=deadline - started,
+                    retries=self._retries(backends, backend),
+                    **schedule,
+                )
+            except Exception as exc:
+                if not _fail_over(exc):
+                    raise
+                backend.observe(task, None, self.alpha)
+                if backend is backends[-1] or time.monotonic() >= deadline:
+                    raise
+                continue
+            backend.observe(task, time.monotonic() - started, self.alpha)
+            if served is not None:
+                served(backend)
+            return result
+
+    async def _acall(self, backend: Backend, backends: list[Backend], task: str, request, deadline: float, schedule):
+        started = time.monotonic()
+        try:
+            result = await backend.scheduler.arun(
+                lambda t: request(backend, t),
+                timeout=deadline - started,
+                retries=self._retries(backends, backend),
+                **schedule,
+            )
+        except asyncio.CancelledError:
+            # Lost a hedge (or the caller gave up): the time spent is a lower
+            # bound on its latency, so a backend that turned slow still gets demoted
+            elapsed = time.monotonic() - started
+            if elapsed > backend.latency.get(task, 0.0):
+                backend.observe(task, elapsed, self.alpha)
+            raise
+        except Exception as exc:
+            if _fail_over(exc):
+                backend.observe(task, None, self.alpha)
+            raise
+        backend.observe(task, time.monotonic() - started, self.alpha)
+        return backend, result
+
+    async def arun(self, task: str, request, *, timeout: float, served=None, **schedule):
+        """Async twin of run(), hedging slow calls for ``hedge_tasks``.
+
+        ``request(backend, timeout)`` returns an awaitable.
+        """
+        deadline = time.monotonic() + timeout
+        backends = self.route(task)
+        pending: set[asyncio.Task] = set()
+        error: BaseException | None = None
+        try:
+            for position, backend in enumerate(backends):
+                pending.add(asyncio.create_task(self._acall(backend, backends, task, request, deadline, schedule)))
+                hedge = self._hedge_delay(backend, task) if position + 1 < len(backends) else None
+                while pending:
+                    done, pending = await asyncio.wait(
+                        pending, timeout=hedge, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        backend.stats["hedges"] += 1
+                        break  # still waiting: start the next backend alongside
+                    for task_done in done:
+                        if task_done.exception() is None:
+                            return self._answer(task_done, served)
+                        error = task_done.exception()
+                    if not _fail_over(error) or time.monotonic() >= deadline:
+                        raise error
+                    if not pending:
+                        break
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task_done in done:
+                    if task_done.exception() is None:
+                        return self._answer(task_done, served)
+                    error = task_done.exception()
+            raise error
+        finally:
+            for leftover in pending:
+                leftover.cancel()
+
+    @staticmethod
+    def _answer(call: asyncio.Task, served):
+        backend, result = call.result()
+        if served is not None:
+            served(backend)
+        return result
+
+    def stream(self, task: str, request, *, timeout: float, served=None, **schedule):
+        """Streaming run(): fails over only until the first chunk arrives.
+
+        ``request(backend, timeout)`` returns an iterator of text chunks; the
+        recorded latency is the time to that first chunk.
+        """
+        deadline = time.monotonic() + timeout
+        backends = self.route(task)
+        for backend in backends:
+            started = time.monotonic()
+            chunks = backend.scheduler.stream(
+                lambda t, b=backend: request(b, t),
+                timeout=deadline - started,
+                retries=self._retries(backends, backend),
+                **schedule,
+            )
+            try:
+                first = next(chunks, None)
+            except Exception as exc:
+                if not _fail_over(exc):
+                    raise
+                backend.observe(task, None, self.alpha)
+                if backend is backends[-1] or time.monotonic() >= deadline:
+                    raise
+                continue
+            backend.observe(task, time.monotonic() - started, self.alpha)
+            if served is not None:
+                served(backend)
+            try:
+                if first is not None:
+                    yield first
+                    yield from chunks
+            finally:
+                chunks.close()
+            return
+
+    async def astream(self, task: str, request, *, timeout: float, served=None, **schedule):
+        """Async twin of stream(); ``request(backend, timeout)`` returns an async iterator."""
+        deadline = time.monotonic() + timeout
+        backends = self.route(task)
+        for backend in backends:
+            started = time.monotonic()
+            chunks = backend.scheduler.astream(
+                lambda t, b=backend: request(b, t),
+                timeout=deadline - started,
+                retries=self._retries(backends, backend),
+                **schedule,
+            )
+            try:
+                first = await anext(chunks, None)
+            except Exception as exc:
+                if not _fail_over(exc):
+                    raise
+                backend.observe(task, None, self.alpha)
+                if backend is backends[-1] or time.monotonic() >= deadline:
+                    raise
+                continue
+            backend.observe(task, time.monotonic() - started, self.alpha)
+            if served is not None:
+                served(backend)
+            try:
+                if first is not None:
+                    yield first
+                    async for chunk in chunks:
+                        yield chunk
+            finally:
+                await chunks.aclose()
+            return
+
+    def stats(self) -> dict:
+        """Per-backend health and counters."""
+        now = time.monotonic()
+        return {
+            backend.name: {
+                **backend.stats,
+                "model": backend.model,
+                "error_rate": round(backend.error_rate, 3),
+                "latency": {task: round(s, 3) for task, s in backend.latency.items()},
+                "healthy": not self._unhealthy(backend, now),
+            }
+            for backend in self.backends
+        }
@@ -0,0 +1,397 @@
+"""Admission control, retries and deadlines for LLM requests.
+
+Every upstream call made by ``llm_client`` goes through one process-wide
+RequestScheduler:
+
+- token buckets cap requests and (estimated) tokens per minute;
+- at most ``max_inflight`` requests are on the wire at once;
+- waiting requests are admitted by priority lane, so interactive chat
+  overtakes queued background work such as handbook sections;
+- transient failures (429, 5xx, timeouts, dropped connections) are retried
+  with jittered exponential backoff, never sooner than the server's
+  Retry-After, and a 429 pauses admission for every caller, not just one;
+- each call has a deadline covering queueing, backoff and the request.
+
+The scheduler is shared by threads and event loops alike: sync callers
+block on a threading.Event, async callers await an asyncio.Event that is
+set thread-safely on their own loop.
+"""
+
+import asyncio
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import openai
+
+# Lower rank is admitted first
+LANES = {"interactive": 0, "background": 1}
+
+
+class DeadlineExceeded(TimeoutError):
+    """An LLM call ran out of time while queued, backing off or in flight."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``per_minute`` / 60 per second.
+
+    A ``per_minute`` of 0 means unlimited. Not thread-safe on its own; the
+    scheduler's lock guards it.
+    """
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.rate = per_minute / 60
+        self.capacity = burst or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken (a request larger than the bucket waits for a full one)."""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float, now: float) -> None:
+        if self.rate:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount: float) -> None:
+        """Return tokens reserved but not used."""
+        if self.rate and amount > 0:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    """A request waiting for admission, wakeable from any thread."""
+
+    __slots__ = ("rank", "tokens", "loop", "event", "state")
+
+    def __init__(self, rank: tuple, tokens: int, loop: asyncio.AbstractEventLoop | None):
+        self.rank = rank
+        self.tokens = tokens
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+        self.state = "queued"  # -> "admitted" or "abandoned"
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return self.rank < other.rank
+
+    def wake(self) -> None:
+        if self.loop is None:
+            self.event.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+def _retry_after(exc: Exception) -> float | None:
+    """Seconds the server asked us to wait, from Retry-After(-Ms) headers."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _retryable(exc: Exception) -> bool:
+    if isinstance(exc, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in (408, 409, 429) or exc.status_code >= 500
+    return False
+
+
+class RequestScheduler:
+    """Priority admission, rate limits, retries and deadlines for upstream calls."""
+
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        max_inflight: int = 16,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        lanes: bool = True,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_inflight = max(1, max_inflight)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lanes = lanes
+        self.stats = {
+            "admitted": 0, "queued": 0, "retries": 0, "rate_limited": 0,
+            "deadline_exceeded": 0, "wait_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+        self._queue: list[_Ticket] = []
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._paused_until = 0.0
+
+    # ------------------------------------------------------------------ #
+    #  Admission                                                           #
+    # ------------------------------------------------------------------ #
+
+    def _ticket(self, lane: str, tokens: int, loop) -> _Ticket:
+        rank = (LANES[lane] if self.lanes else 0, next(self._seq))
+        ticket = _Ticket(rank, tokens, loop)
+        with self._lock:
+            heapq.heappush(self._queue, ticket)
+            if self._queue[0] is not ticket or self._inflight >= self.max_inflight:
+                self.stats["queued"] += 1
+        return ticket
+
+    def _wake_head(self) -> None:
+        """Under the lock: drop abandoned tickets and wake the next in line."""
+        while self._queue and self._queue[0].state == "abandoned":
+            heapq.heappop(self._queue)
+        if self._queue and self._inflight < self.max_inflight:
+            self._queue[0].wake()
+
+    def _try_admit(self, ticket: _Ticket) -> float | None:
+        """Admit ``ticket`` if it is next in line and may run.
+
+        Returns 0 once admitted, otherwise the seconds after which to check
+        again, or None to wait until woken.
+        """
+        with self._lock:
+            ticket.event.clear()
+            while self._queue and self._queue[0].state == "abandoned":
+                heapq.heappop(self._queue)
+            if self._queue[0] is not ticket or self._inflight >= self.max_inflight:
+                return None
+            now = time.monotonic()
+            delay = max(
+                self._paused_until - now,
+                self.requests.delay(1, now),
+                self.tokens.delay(ticket.tokens, now),
+            )
+            if delay > 0:
+                return delay
+            heapq.heappop(self._queue)
+            self.requests.take(1, now)
+            self.tokens.take(ticket.tokens, now)
+            self._inflight += 1
+            ticket.state = "admitted"
+            self.stats["admitted"] += 1
+            self._wake_head()
+            return 0.0
+
+    def _abandon(self, ticket: _Ticket) -> None:
+        with self._lock:
+            if ticket.state == "queued":
+                ticket.state = "abandoned"
+                self._wake_head()
+
+    def _deadline_exceeded(self) -> DeadlineExceeded:
+        with self._lock:
+            self.stats["deadline_exceeded"] += 1
+        return DeadlineExceeded("LLM request deadline exceeded")
+
+    def acquire(self, lane: str, tokens: int, deadline: float) -> _Ticket:
+        """Block until a request of ``tokens`` estimated tokens may start."""
+        ticket = self._ticket(lane, tokens, None)
+        started = time.monotonic()
+        try:
+            while (wait := self._try_admit(ticket)) != 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._deadline_exceeded()
+                ticket.event.wait(remaining if wait is None else min(wait, remaining))
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        self._waited(started)
+        return ticket
+
+    async def aacquire(self, lane: str, tokens: int, deadline: float) -> _Ticket:
+        """Async twin of acquire(); waits without blocking the event loop."""
+        ticket = self._ticket(lane, tokens, asyncio.get_running_loop())
+        started = time.monotonic()
+        try:
+            while (wait := self._try_admit(ticket)) != 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._deadline_exceeded()
+                try:
+                    await asyncio.wait_for(
+                        ticket.event.wait(), remaining if wait is None else min(wait, remaining)
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._abandon(ticket)
+            raise
+        self._waited(started)
+        return ticket
+
+    def _waited(self, started: float) -> None:
+        with self._lock:
+            self.stats["wait_seconds"] += time.monotonic() - started
+
+    def release(self, ticket: _Ticket, used_tokens: int | None = None) -> None:
+        """Free the request's slot, refunding reserved tokens it did not use."""
+        with self._lock:
+            self._inflight -= 1
+            if used_tokens is not None:
+                self.tokens.give(ticket.tokens - used_tokens)
+            self._wake_head()
+
+    def pause(self, seconds: float) -> None:
+        """Admit nothing for ``seconds``, e.g. after the server said 429."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    # ------------------------------------------------------------------ #
+    #  Retries                                                             #
+    # ------------------------------------------------------------------ #
+
+    def _retry_delay(self, exc: Exception, attempt: int, deadline: float, retries: int | None) -> float:
+        """Backoff before retrying after ``exc``, or re-raise it when that is pointless."""
+        if not _retryable(exc):
+            raise exc
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if isinstance(exc, openai.RateLimitError):
+            # Hold everyone back, even if this call gives up or goes elsewhere
+            self.stats["rate_limited"] += 1
+            self.pause(delay)
+        if attempt >= (self.max_retries if retries is None else retries):
+            raise exc
+        if time.monotonic() + delay >= deadline:
+            if isinstance(exc, openai.APITimeoutError):
+                raise self._deadline_exceeded() from exc
+            raise exc
+        self.stats["retries"] += 1
+        return delay
+
+    def run(
+        self, request, *, lane: str, tokens: int, timeout: float, cost=None, retries: int | None = None
+    ):
+        """Call ``request(timeout)`` once admitted, retrying transient failures.
+
+        ``request`` receives the seconds left until the deadline for its own
+        HTTP timeout; ``cost(result)``, if given, reports the tokens actually
+        used so the unused part of the reservation is refunded. ``retries``
+        overrides ``max_retries`` for this call.
+        """
+        deadline = time.monotonic() + timeout
+        for attempt in itertools.count():
+            ticket = self.acquire(lane, tokens, deadline)
+            try:
+                result = request(deadline - time.monotonic())
+            except Exception as exc:
+                self.release(ticket)
+                time.sleep(self._retry_delay(exc, attempt, deadline, retries))
+                continue
+            except BaseException:
+                self.release(ticket)
+                raise
+            self.release(ticket, cost(result) if cost else None)
+            return result
+
+    async def arun(
+        self, request, *, lane: str, tokens: int, timeout: float, cost=None, retries: int | None = None
+    ):
+        """Async twin of run(); ``request(timeout)`` returns an awaitable."""
+        deadline = time.monotonic() + timeout
+        for attempt in itertools.count():
+            ticket = await self.aacquire(lane, tokens, deadline)
+            try:
+                result = await request(deadline - time.monotonic())
+            except Exception as exc:
+                self.release(ticket)
+                await asyncio.sleep(self._retry_delay(exc, attempt, deadline, retries))
+                continue
+            except BaseException:
+                self.release(ticket)
+                raise
+            self.release(ticket, cost(result) if cost else None)
+            return result
+
+    def stream(
+        self, request, *, lane: str, tokens: int, timeout: float, cost=None, retries: int | None = None
+    ):
+        """Streaming run(): ``request(timeout)`` returns an iterator of text chunks.
+
+        Failures are retried only until the first chunk arrives; after that
+        the stream is the caller's, and the deadline no longer applies.
+        """
+        deadline = time.monotonic() + timeout
+        for attempt in itertools.count():
+            ticket = self.acquire(lane, tokens, deadline)
+            try:
+                chunks = iter(request(deadline - time.monotonic()))
+                first = next(chunks, None)
+            except Exception as exc:
+                self.release(ticket)
+                time.sleep(self._retry_delay(exc, attempt, deadline, retries))
+                continue
+            except BaseException:
+                self.release(ticket)
+                raise
+            parts = []
+            try:
+                if first is not None:
+                    parts.append(first)
+                    yield first
+                for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            finally:
+                self.release(ticket, cost("".join(parts)) if cost else None)
+            return
+
+    async def astream(
+        self, request, *, lane: str, tokens: int, timeout: float, cost=None, retries: int | None = None
+    ):
+        """Async twin of stream(); ``request(timeout)`` returns an async iterator of chunks."""
+        deadline = time.monotonic() + timeout
+        for attempt in itertools.count():
+            ticket = await self.aacquire(lane, tokens, deadline)
+            try:
+                chunks = aiter(request(deadline - time.monotonic()))
+                first = await anext(chunks, None)
+            except Exception as exc:
+                self.release(ticket)
+                await asyncio.sleep(self._retry_delay(exc, attempt, deadline, retries))
+                continue
+            except BaseException:
+                self.release(ticket)
+                raise
+            parts = []
+            try:
+                if first is not None:
+                    parts.append(first)
+                    yield first
+                async for chunk in chunks:
+                    parts.append(chunk)
+                    yield chunk
+            finally:
+                self.release(ticket, cost("".join(parts)) if cost else None)
+            return
@@ -1,24 +1,268 @@
 """PDF upload and text extraction."""
 
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import NamedTuple
+
 import pdfplumber
+import tiktoken
 from pathlib import Path
 
+from app import config
+
+
+class Page(NamedTuple):
+    number: int  # 1-based
+    text: str
+
+
+class Chunk(NamedTuple):
+    """Token-bounded run of consecutive pages (or a slice of one long page)."""
+    text: str
+    first_page: int
+    last_page: int
+    tokens: int
+
+
+# Shared extraction pool, created on first parallel extraction
+_pool: ProcessPoolExecutor | None = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _available_cpus() -> int:
+    """CPUs this process may run on: its affinity mask, capped by a cgroup v2 CPU quota.
+
+    ``os.cpu_count()`` counts the host's CPUs, which over-provisions the
+    pool in a CPU-limited container.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on macOS / Windows
+        cpus = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, -(-int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def _worker_count(workers: int | None = None) -> int:
+    workers = workers or config.PDF_WORKERS
+    return workers if workers > 0 else _available_cpus()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the process-wide extraction pool, resizing it if needed."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: forking a threaded server process (Gradio) is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> list[str]:
+    """Extract pages [start, stop) of one PDF. Runs in a worker process."""
+    texts = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            texts.append(page.extract_text() or "")
+            page.close()  # drop pdfplumber's per-page layout cache
+    return texts
+
+
+def page_count(pdf_path: str | Path) -> int:
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def _shards(pdf_paths: list[str | Path], pages_per_task: int) -> list[tuple[int, str, int, int]]:
+    """(file_index, path, start, stop) page ranges covering every file in order."""
+    tasks = []
+    for file_index, path in enumerate(pdf_paths):
+        count = page_count(path)
+        for start in range(0, count, pages_per_task):
+            tasks.append((file_index, str(path), start, min(start + pages_per_task, count)))
+    return tasks
+
+
+def iter_extracted_pages(pdf_paths: list[str | Path], workers: int | None = None):
+    """Extract pages of several PDFs across a process pool.
+
+    Page ranges of every file are sharded over the workers, and results are
+    yielded in order as (file_index, page_number, text) tuples, page numbers
+    starting at 1. At most two shards per worker are in flight, so results
+    never pile up ahead of a slow consumer.
+    """
+    workers = _worker_count(workers)
+    tasks = _shards(pdf_paths, max(1, config.PDF_PAGES_PER_TASK))
+
+    if workers == 1 or len(tasks) <= 1:
+        for file_index, path, start, stop in tasks:
+            for offset, text in enumerate(_extract_range(path, start, stop)):
+                yield file_index, start + offset + 1, text
+        return
+
+    pool = _get_pool(workers)
+    task_iter = iter(tasks)
+    pending = deque()
+
+    def submit_next() -> None:
+        task = next(task_iter, None)
+        if task is not None:
+            file_index, path, start, stop = task
+            pending.append((file_index, start, pool.submit(_extract_range, path, start, stop)))
 
-def extract_text(pdf_path: str | Path) -> str:
+    for _ in range(workers * 2):
+        submit_next()
+    try:
+        while pending:
+            file_index, start, future = pending.popleft()
+            submit_next()
+            for offset, text in enumerate(future.result()):
+                yield file_index, start + offset + 1, text
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+
+
+def iter_pages(pdf_path: str | Path, workers: int | None = None):
+    """Yield the pages of one PDF in order, extracted across the process pool."""
+    for _, number, text in iter_extracted_pages([pdf_path], workers):
+        yield Page(number, text)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding("o200k_base")
+
+
+def file_digest(pdf_path: str | Path) -> str:
+    """SHA-256 of the file contents, read in 1 MiB blocks."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_chunks(
+    pdf_path: str | Path,
+    max_tokens: int | None = None,
+    workers: int | None = None,
+    digest: str | None = None,
+):
+    """Yield token-bounded chunks of a PDF with their page range.
+
+    Consecutive pages are packed until the next one would exceed
+    ``max_tokens`` (default ``config.INSERT_CHUNK_TOKENS``); a single page
+    longer than that is split at token boundaries. Only one chunk's worth of
+    text is held at a time, however large the document.
+
+    When the file's content ``digest`` is given, chunks are cached on disk
+    under it and later calls replay them without running pdfplumber.
+    """
+    max_tokens = max_tokens or config.INSERT_CHUNK_TOKENS
+    if digest is None:
+        yield from _extract_chunks(pdf_path, max_tokens, workers)
+        return
+
+    cache_path = Path(config.EXTRACT_CACHE_DIR) / f"{digest}-{max_tokens}.jsonl"
+    if cache_path.exists():
+        with open(cache_path, encoding="utf-8") as f:
+            for line in f:
+                yield Chunk(*json.loads(line))
+        return
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # A temp file of its own, so concurrent extractions of one digest never interleave
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=cache_path.parent, suffix=".partial", delete=False
+    ) as f:
+        try:
+            for chunk in _extract_chunks(pdf_path, max_tokens, workers):
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                yield chunk
+        except BaseException:  # failed or closed early (GeneratorExit)
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, cache_path)  # only complete extractions become cache hits
+
+
+def _extract_chunks(pdf_path: str | Path, max_tokens: int, workers: int | None):
+    enc = _encoding()
+    parts: list[str] = []
+    tokens = 0
+    first = last = 0
+
+    for page in iter_pages(pdf_path, workers):
+        if not page.text:
+            continue
+        page_tokens = enc.encode(page.text, disallowed_special=())
+        if parts and tokens + len(page_tokens) > max_tokens:
+            yield Chunk("\n\n".join(parts), first, last, tokens)
+            parts, tokens = [], 0
+        if len(page_tokens) > max_tokens:
+            for start in range(0, len(page_tokens), max_tokens):
+                window = page_tokens[start:start + max_tokens]
+                yield Chunk(enc.decode(window), page.number, page.number, len(window))
+            continue
+        if not parts:
+            first = page.number
+        parts.append(page.text)
+        tokens += len(page_tokens)
+        last = page.number
+
+    if parts:
+        yield Chunk("\n\n".join(parts), first, last, tokens)
+
+
+def extract_texts(pdf_paths: list[str | Path], workers: int | None = None) -> list[str]:
+    """Extract the text of several PDFs in parallel, one string per file."""
+    parts: list[list[str]] = [[] for _ in pdf_paths]
+    for file_index, _, text in iter_extracted_pages(pdf_paths, workers):
+        if text:
+            parts[file_index].append(text)
+    return ["\n\n".join(p) for p in parts]
+
+
+def extract_text(pdf_path: str | Path, workers: int | None = None) -> str:
     """Extract all text from a PDF file."""
+    return extract_texts([pdf_path], workers)[0]
+
+
+def extract_text_from_bytes(pdf_bytes: bytes, filename: str = "upload.pdf") -> str:
+    """Extract text from in-memory PDF bytes (for Gradio file uploads)."""
     text_parts = []
-    with pdfplumber.open(pdf_path) as pdf:
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
         for page in pdf.pages:
             page_text = page.extract_text()
             if page_text:
                 text_parts.append(page_text)
+            page.close()
     return "\n\n".join(text_parts)
-
-
-def extract_text_from_bytes(pdf_bytes: bytes, filename: str = "upload.pdf") -> str:
-    """Extract text from in-memory PDF bytes (for Gradio file uploads)."""
-    import tempfile
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=True) as tmp:
-        tmp.write(pdf_bytes)
-        tmp.flush()
-        return extract_text(tmp.name)
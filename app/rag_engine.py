@@ -1,36 +1,214 @@
 """LightRAG knowledge graph engine with local storage."""
 
 import asyncio
+import atexit
+import concurrent.futures
+import dataclasses
+import functools
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
 from lightrag import LightRAG, QueryParam
-from lightrag.llm.openai import openai_complete, openai_embed
+from lightrag.constants import GRAPH_FIELD_SEP
+from lightrag.prompt import PROMPTS
 from lightrag.utils import EmbeddingFunc
 from app import config
+from app.embeddings import get_embedder
+from app.llm_client import achat, achat_stream
 
 
 # Module-level RAG instance (initialized lazily)
 _rag: LightRAG | None = None
 
+# Background event loop that owns the RAG instance. LightRAG's storages and
+# locks are bound to the loop they were created on, so every coroutine that
+# touches them runs here, whichever thread or loop the caller is on.
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_thread: threading.Thread | None = None
+_loop_lock = threading.Lock()
+# Serializes creation of the RAG instance (created on the RAG loop)
+_rag_lock: asyncio.Lock | None = None
+# Seconds spent initializing storages and answering the first query
+_timings: dict[str, float] = {}
+
+# Content hashes of documents already in the index, persisted next to it
+_INDEXED_FILE = "indexed_documents.json"
+_indexed: dict[str, dict] | None = None
+
+# Bumped on every insert; cached query results from older generations are stale
+_index_generation = 0
+
+
+class _QueryCache:
+    """LRU + TTL cache of query results for one index generation."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple, tuple[float, str]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def get(self, key: tuple) -> str | None:
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            self.stats["expired"] += 1
+            entry = None
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, key: tuple, result: str) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic(), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def clear(self) -> None:
+        if self._entries:
+            self.stats["invalidations"] += 1
+        self._entries.clear()
+
+    def info(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "generation": _index_generation,
+        }
+
+
+_query_cache = _QueryCache(config.QUERY_CACHE_SIZE, config.QUERY_CACHE_TTL)
+
+
+async def _llm_complete(
+    prompt: str,
+    system_prompt: str | None = None,
+    history_messages: list[dict] | None = None,
+    keyword_extraction: bool = False,
+    **kwargs,
+):
+    """LightRAG llm_model_func backed by the pooled Grok client.
+
+    LightRAG's stock ``openai_complete`` opens and closes a new client per
+    call; routing through ``llm_client`` keeps extraction and query calls on
+    the same warm connections as the rest of the app. ``llm_role`` comes from
+    ``_ROLE_CONFIGS``: indexing (entity extraction and description merging)
+    queues in the scheduler's background lane, query-time calls do not, and
+    extraction and keyword calls are routed as the "extraction" task.
+    """
+    response_format = kwargs.get("response_format")
+    if (keyword_extraction or kwargs.get("entity_extraction")) and not response_format:
+        response_format = {"type": "json_object"}
+    options = {k: kwargs[k] for k in ("max_tokens", "temperature") if kwargs.get(k) is not None}
+    role = kwargs.get("llm_role")
+    options["priority"] = "background" if role == "extract" else "interactive"
+    options["task"] = "chat" if role == "query" else "extraction"
+
+    if kwargs.get("stream"):
+        return achat_stream(
+            prompt, system=system_prompt, history=history_messages, **options
+        )
+    return await achat(
+        prompt,
+        system=system_prompt,
+        history=history_messages,
+        response_format=response_format,
+        **options,
+    )
+
+
+def _rag_loop() -> asyncio.AbstractEventLoop:
+    """Return the RAG loop, starting its thread on first use."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(
+                target=_loop.run_forever, name="rag-loop", daemon=True
+            )
+            _loop_thread.start()
+            atexit.register(shutdown)
+        return _loop
+
+
+def _on_rag_loop(func):
+    """Run the decorated coroutine function on the RAG loop.
+
+    Called from the RAG loop itself it is awaited directly; from any other
+    loop it is submitted to the RAG loop and awaited without blocking the
+    caller's loop (cancelling the caller cancels the submitted task).
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = _rag_loop()
+        if asyncio.get_running_loop() is loop:
+            return await func(*args, **kwargs)
+        future = asyncio.run_coroutine_threadsafe(func(*args, **kwargs), loop)
+        return await asyncio.wrap_future(future)
+    return wrapper
+
+
+def _run_sync(coro):
+    """Run a coroutine on the RAG loop from synchronous code and wait for it."""
+    loop = _rag_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("sync rag_engine calls cannot be made from the RAG loop thread")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def shutdown() -> None:
+    """Flush LightRAG storages and stop the RAG loop thread."""
+    global _rag, _rag_lock, _loop, _loop_thread
+    with _loop_lock:
+        loop, thread = _loop, _loop_thread
+        _loop = _loop_thread = None
+        _rag_lock = None
+    if loop is None:
+        return
+    if _rag is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(_rag.finalize_storages(), loop).result(timeout=30)
+        finally:
+            _rag = None
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+
+
+# Tell _llm_complete which LightRAG role each call comes from
+_ROLE_CONFIGS = {role: {"kwargs": {"llm_role": role}} for role in ("extract", "keyword", "query")}
+
 
 async def _create_rag() -> LightRAG:
     """Create and initialize a LightRAG instance."""
     os.makedirs(config.RAG_WORKING_DIR, exist_ok=True)
+    # Loading a local embedding model takes seconds; keep it off the event loop
+    embedder = await asyncio.to_thread(get_embedder)
 
     rag = LightRAG(
         working_dir=config.RAG_WORKING_DIR,
-        llm_model_func=openai_complete,
+        llm_model_func=_llm_complete,
         llm_model_name=config.GROK_MODEL,
-        llm_model_kwargs={
-            "base_url": config.XAI_BASE_URL,
-            "api_key": config.XAI_API_KEY,
-        },
+        role_llm_configs=_ROLE_CONFIGS,
         embedding_func=EmbeddingFunc(
-            embedding_dim=1536,
+            embedding_dim=embedder.dim,
             max_token_size=8192,
-            func=lambda texts: openai_embed.func(
-                texts, api_key=config.OPENAI_API_KEY
-            ),
+            func=embedder,
         ),
+        # Larger batches per call; the embedder re-packs them to provider limits
+        embedding_batch_num=config.EMBED_BATCH_SIZE,
         chunk_token_size=config.CHUNK_TOKEN_SIZE,
         chunk_overlap_token_size=config.CHUNK_OVERLAP_TOKEN_SIZE,
     )
@@ -38,31 +216,399 @@ async def _create_rag() -> LightRAG:
     return rag
 
 
+@_on_rag_loop
 async def get_rag() -> LightRAG:
-    """Get or create the singleton RAG instance."""
-    global _rag
-    if _rag is None:
-        _rag = await _create_rag()
+    """Get or create the singleton RAG instance.
+
+    Concurrent first callers wait on one initialization instead of each
+    loading the storages; a failed initialization is retried by the next
+    caller.
+    """
+    global _rag, _rag_lock
+    if _rag is not None:
+        return _rag
+    if _rag_lock is None:
+        _rag_lock = asyncio.Lock()
+    async with _rag_lock:
+        if _rag is None:
+            start = time.monotonic()
+            _rag = await _create_rag()
+            _timings["init_seconds"] = time.monotonic() - start
     return _rag
 
 
+def submit(coro) -> concurrent.futures.Future:
+    """Start a rag_engine coroutine on the RAG loop without waiting for it.
+
+    The returned future can be awaited from any loop via
+    ``asyncio.wrap_future`` or waited on from sync code with ``result()``.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _rag_loop())
+
+
+def warm_up() -> concurrent.futures.Future:
+    """Start loading the graph and vector stores in the background.
+
+    Returns a future that resolves to the RAG instance, so startup can
+    report when (or whether) the index is ready.
+    """
+    return submit(get_rag())
+
+
+def startup_timings() -> dict[str, float]:
+    """``init_seconds`` and ``first_query_seconds``, once each has happened."""
+    return dict(_timings)
+
+
+def _indexed_documents() -> dict[str, dict]:
+    global _indexed
+    if _indexed is None:
+        path = Path(config.RAG_WORKING_DIR) / _INDEXED_FILE
+        _indexed = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+    return _indexed
+
+
+def is_indexed(digest: str) -> bool:
+    """Whether a document with this content hash has already been inserted."""
+    return digest in _indexed_documents()
+
+
+def mark_indexed(digest: str, **info) -> None:
+    """Record a fully inserted document so re-uploads can skip it."""
+    documents = _indexed_documents()
+    documents[digest] = info
+    path = Path(config.RAG_WORKING_DIR) / _INDEXED_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(documents, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+def _bump_generation() -> None:
+    """Invalidate cached query results after the index changed."""
+    global _index_generation
+    _index_generation += 1
+    _query_cache.clear()
+
+
+def query_cache_stats() -> dict:
+    """Hit/miss counters, hit rate and size of the query result cache."""
+    return _query_cache.info()
+
+
+@_on_rag_loop
 async def insert_document(text: str) -> None:
     """Insert document text into the knowledge graph."""
     rag = await get_rag()
-    await rag.ainsert(text)
+    try:
+        await rag.ainsert(text)
+    finally:
+        _bump_generation()
+
+
+@_on_rag_loop
+async def insert_batch(texts: list[str], sources: list[str]) -> None:
+    """Insert several documents in one LightRAG pipeline run."""
+    rag = await get_rag()
+    try:
+        await rag.ainsert(texts, file_paths=sources)
+    finally:
+        _bump_generation()
+
+
+def _query_key(question: str, param: QueryParam) -> tuple:
+    normalized = " ".join(question.lower().split())
+    fields = tuple((f.name, repr(getattr(param, f.name))) for f in dataclasses.fields(param))
+    return normalized, param.mode, fields
+
+
+@_on_rag_loop
+async def query(question: str, mode: str = "hybrid", param: QueryParam | None = None) -> str:
+    """Query the knowledge graph. Modes: naive, local, global, hybrid, mix.
+
+    Results are cached per (normalized question, mode, QueryParam) until the
+    next insert or ``config.QUERY_CACHE_TTL``. Streaming queries bypass the
+    cache.
+    """
+    param = param or QueryParam(mode=mode)
+    start = time.monotonic()
+    rag = await get_rag()
+    if param.stream:
+        return await rag.aquery(question, param=param)
+
+    key = _query_key(question, param)
+    cached = _query_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = _index_generation
+    result = await rag.aquery(question, param=param)
+    _timings.setdefault("first_query_seconds", time.monotonic() - start)
+    # An insert that finished meanwhile may have changed the answer
+    if generation == _index_generation and isinstance(result, str):
+        _query_cache.put(key, result)
+    return result
+
+
+def _context_param(mode: str, budget: int, **extra) -> QueryParam:
+    """Retrieval-only QueryParam bounded to ``budget`` tokens.
+
+    The entity and relation shares keep LightRAG's default proportions.
+    """
+    defaults = QueryParam()
+    scale = budget / defaults.max_total_tokens
+    return QueryParam(
+        mode=mode,
+        only_need_context=True,
+        max_total_tokens=budget,
+        max_entity_tokens=int(defaults.max_entity_tokens * scale),
+        max_relation_tokens=int(defaults.max_relation_tokens * scale),
+        **extra,
+    )
+
+
+@_on_rag_loop
+async def retrieve_context(question: str, mode: str = "hybrid", max_tokens: int | None = None) -> str:
+    """Retrieved entities, relations and chunks for ``question``, without an answer.
+
+    Runs LightRAG's retrieval only (``only_need_context``), so the caller
+    makes the single generation call itself. ``max_tokens`` (default
+    ``config.CHAT_CONTEXT_TOKENS``) bounds the whole context. Returns "" when
+    nothing relevant is indexed.
+    """
+    param = _context_param(mode, max_tokens or config.CHAT_CONTEXT_TOKENS)
+    context = await query(question, param=param)
+    if not context or context == PROMPTS["fail_response"]:
+        return ""
+    return context
+
+
+BATCH_KEYWORDS_PROMPT = """Extract search keywords for each numbered query below.{topic}
+
+For every query give high-level keywords (overarching concepts or themes) and low-level keywords (specific entities, terms or details).
 
+Return JSON only, one entry per query, in this shape:
+{{"queries": [{{"id": 1, "high_level_keywords": ["..."], "low_level_keywords": ["..."]}}]}}
+
+Queries:
+{queries}"""
+
+
+async def _extract_keywords_batch(
+    questions: list[str], topic: str | None, priority: str = "interactive"
+) -> list[tuple[list, list]]:
+    """High/low-level keywords for every question from one LLM call.
+
+    Questions the model skips (or a failed call) get empty keyword lists,
+    which makes LightRAG fall back to extracting them itself.
+    """
+    keywords = [([], []) for _ in questions]
+    prompt = BATCH_KEYWORDS_PROMPT.format(
+        topic=f" They all belong to a document about: {topic}" if topic else "",
+        queries="\n".join(f"{i}. {q}" for i, q in enumerate(questions, start=1)),
+    )
+    try:
+        response = await achat(
+            prompt,
+            temperature=0.0,
+            response_format={"type": "json_object"},
+            priority=priority,
+            task="extraction",
+        )
+        entries = json.loads(response).get("queries", [])
+    except Exception:
+        return keywords
+    for entry in entries:
+        try:
+            index = int(entry["id"]) - 1
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= index < len(questions):
+            keywords[index] = (
+                [str(k) for k in entry.get("high_level_keywords", [])],
+                [str(k) for k in entry.get("low_level_keywords", [])],
+            )
+    return keywords
+
+
+class Retrieval(NamedTuple):
+    """Retrieval-only result for one query, with token counts for budgeting."""
+    facts: list[tuple[str, int]]  # entity and relationship lines, with tokens
+    chunks: list[tuple[str, str, int]]  # (chunk id, text, tokens), best first
+    linked_chunks: list[str]  # ids of the chunks the facts were extracted from
+
+
+def _linked_chunk_ids(items: list[dict]) -> list[str]:
+    ids = []
+    for item in items:
+        ids.extend(i for i in item.get("source_id", "").split(GRAPH_FIELD_SEP) if i)
+    return list(dict.fromkeys(ids))
+
+
+def _to_retrieval(tokenizer, data: dict) -> Retrieval:
+    def count(text: str) -> int:
+        return len(tokenizer.encode(text))
+
+    lines = [
+        f"- {e.get('entity_name', '')} ({e.get('entity_type', '')}): {e.get('description', '')}"
+        for e in data.get("entities", [])
+    ] + [
+        f"- {r.get('src_id', '')} -> {r.get('tgt_id', '')}: {r.get('description', '')}"
+        for r in data.get("relationships", [])
+    ]
+    chunks = []
+    for c in data.get("chunks", []):
+        text = f"[{c.get('file_path', '')}]\n{c.get('content', '')}"
+        chunks.append((_chunk_key(c), text, count(text)))
+    return Retrieval(
+        facts=[(line, count(line)) for line in lines],
+        chunks=chunks,
+        linked_chunks=_linked_chunk_ids(data.get("entities", []) + data.get("relationships", [])),
+    )
 
-async def query(question: str, mode: str = "hybrid") -> str:
-    """Query the knowledge graph. Modes: naive, local, global, hybrid, mix."""
+
+def format_retrieval(
+    retrieval: Retrieval, max_tokens: int, extra_chunks: list[tuple[str, str, int]] = ()
+) -> str:
+    """Render a Retrieval into at most ``max_tokens`` tokens.
+
+    Entity and relationship facts may use two fifths of the budget; chunks,
+    the source text a writer needs most, get the rest, with ``extra_chunks``
+    (already known related chunks) only after the query's own.
+    """
+    def fit(items, allowance):
+        kept, used = [], 0
+        for text, tokens in items:
+            if used + tokens > allowance:
+                break
+            kept.append(text)
+            used += tokens
+        return kept, used
+
+    facts, used = fit(retrieval.facts, int(max_tokens * 0.4))
+    chunks, _ = fit(
+        [(text, tokens) for _, text, tokens in [*retrieval.chunks, *extra_chunks]],
+        max_tokens - used,
+    )
+    parts = []
+    if facts:
+        parts.append("Entities and relationships:\n" + "\n".join(facts))
+    if chunks:
+        parts.append("Document chunks:\n" + "\n\n".join(chunks))
+    return "\n\n".join(parts)
+
+
+def _chunk_key(chunk: dict) -> str:
+    return chunk.get("chunk_id") or chunk.get("content", "")
+
+
+@_on_rag_loop
+async def retrieve_batch(
+    questions: list[str],
+    mode: str = "hybrid",
+    max_tokens: int | None = None,
+    topic: str | None = None,
+    priority: str = "interactive",
+) -> list[Retrieval]:
+    """Retrieval-only results for many sub-queries at once, one per query.
+
+    Keywords for all queries come from a single LLM call instead of one per
+    query, retrieval then runs concurrently (``config.RAG_BULK_CONCURRENCY``)
+    with those keywords, and a chunk retrieved by several queries is kept
+    only where it ranked highest, so sections do not all repeat the same
+    source text. ``max_tokens`` (default ``config.SECTION_CONTEXT_TOKENS``)
+    is the per-query budget the results will be formatted into; ``priority``
+    is the llm_client scheduler lane of the keyword call.
+    """
+    if not questions:
+        return []
+    budget = max_tokens or config.SECTION_CONTEXT_TOKENS
     rag = await get_rag()
-    return await rag.aquery(question, param=QueryParam(mode=mode))
+    keywords = await _extract_keywords_batch(questions, topic, priority)
+
+    async def fetch(question: str, high: list, low: list) -> dict:
+        # Over-fetch so dedupe still leaves each query a full budget
+        param = _context_param(mode, budget * 2, hl_keywords=high, ll_keywords=low)
+        result = await rag.aquery_data(question, param)
+        return (result.get("data") or {}) if result.get("status") == "success" else {}
+
+    results = await _gather_limited(
+        [fetch(q, high, low) for q, (high, low) in zip(questions, keywords)],
+        config.RAG_BULK_CONCURRENCY,
+    )
+
+    owner: dict[str, tuple[int, int]] = {}  # chunk -> (query index, rank)
+    for index, data in enumerate(results):
+        for rank, chunk in enumerate(data.get("chunks", [])):
+            key = _chunk_key(chunk)
+            if key not in owner or rank < owner[key][1]:
+                owner[key] = (index, rank)
+
+    retrievals = []
+    for index, data in enumerate(results):
+        chunks = [c for c in data.get("chunks", []) if owner[_chunk_key(c)][0] == index]
+        retrievals.append(_to_retrieval(rag.tokenizer, {**data, "chunks": chunks}))
+    return retrievals
+
+
+async def retrieve_contexts(
+    questions: list[str],
+    mode: str = "hybrid",
+    max_tokens: int | None = None,
+    topic: str | None = None,
+) -> list[str]:
+    """retrieve_batch() formatted into one context string per query.
+
+    An empty string means nothing relevant was found.
+    """
+    budget = max_tokens or config.SECTION_CONTEXT_TOKENS
+    retrievals = await retrieve_batch(questions, mode, budget, topic)
+    return [format_retrieval(r, budget) for r in retrievals]
+
+
+async def _gather_limited(coros, limit: int) -> list:
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(c) for c in coros))
 
 
 def insert_document_sync(text: str) -> None:
     """Synchronous wrapper for insert_document."""
-    asyncio.get_event_loop().run_until_complete(insert_document(text))
+    _run_sync(insert_document(text))
 
 
 def query_sync(question: str, mode: str = "hybrid") -> str:
     """Synchronous wrapper for query."""
-    return asyncio.get_event_loop().run_until_complete(query(question, mode))
+    return _run_sync(query(question, mode))
+
+
+def insert_many_sync(
+    texts: list[str],
+    sources: list[str] | None = None,
+    batch_size: int | None = None,
+    concurrency: int | None = None,
+) -> None:
+    """Insert many documents from synchronous code, batches in parallel.
+
+    Documents are grouped into ``insert_batch`` calls of ``batch_size``
+    (default ``config.INGEST_BATCH_SIZE``), at most ``concurrency`` (default
+    ``config.RAG_BULK_CONCURRENCY``) in flight, all on the one RAG instance.
+    """
+    sources = sources or [f"document {i + 1}" for i in range(len(texts))]
+    size = max(1, batch_size or config.INGEST_BATCH_SIZE)
+    batches = [
+        insert_batch(texts[i:i + size], sources[i:i + size])
+        for i in range(0, len(texts), size)
+    ]
+    _run_sync(_gather_limited(batches, concurrency or config.RAG_BULK_CONCURRENCY))
+
+
+def query_many_sync(
+    questions: list[str], mode: str = "hybrid", concurrency: int | None = None
+) -> list[str]:
+    """Answer several questions from synchronous code, concurrently, in order."""
+    coros = [query(q, mode) for q in questions]
+    return _run_sync(_gather_limited(coros, concurrency or config.RAG_BULK_CONCURRENCY))
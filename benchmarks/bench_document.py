@@ -0,0 +1,70 @@
+"""Per-step bookkeeping cost of handbook accumulation, old vs HandbookDocument.
+
+Simulates the writer loop without any LLM calls: after each section the old
+code re-split the whole document for the prompt tail and the word count,
+while HandbookDocument keeps a running count and PromptBuilder encodes each
+section once for the tail. Run from the project root:
+
+    python -m benchmarks.bench_document [--sections 100] [--section-words 1000]
+"""
+
+import argparse
+import time
+
+from app.handbook_generator import HandbookDocument, PlanStep, PromptBuilder
+
+
+def _old_recent_text(full_text: str, max_words: int = 3000) -> str:
+    words = full_text.split()
+    if len(words) <= max_words:
+        return full_text
+    return "... " + " ".join(words[-max_words:])
+
+
+def _run_old(sections: list[str]) -> list[float]:
+    timings = []
+    full_text = ""
+    for section in sections:
+        start = time.perf_counter()
+        _old_recent_text(full_text)
+        full_text += section + "\n\n"
+        len(full_text.split())  # word count in main.handle_chat
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _run_builder(sections: list[str]) -> list[float]:
+    timings = []
+    document = HandbookDocument()
+    steps = [PlanStep(i, f"Topic {i}", 1000) for i in range(len(sections))]
+    builder = PromptBuilder("Write a handbook.", steps)
+    for index, section in enumerate(sections):
+        start = time.perf_counter()
+        builder.write_prompt(index, document, context="")
+        document.append(section)
+        document.word_count
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _report(label: str, timings: list[float]) -> None:
+    total_ms = sum(timings) * 1000
+    last_ms = timings[-1] * 1000
+    print(f"{label:<16} total {total_ms:9.1f} ms   last step {last_ms:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=100)
+    parser.add_argument("--section-words", type=int, default=1000)
+    args = parser.parse_args()
+
+    section = " ".join(f"word{i}" for i in range(args.section_words))
+    sections = [section] * args.sections
+    print(f"{args.sections} sections, {args.sections * args.section_words:,} words")
+    _report("old (+= / split)", _run_old(sections))
+    _report("HandbookDocument", _run_builder(sections))
+
+
+if __name__ == "__main__":
+    main()
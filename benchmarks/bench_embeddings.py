@@ -0,0 +1,79 @@
+"""Embedding requests and wall time: direct calls vs the batched, cached layer.
+
+Feeds overlapping chunk texts (as produced by LightRAG's overlapping chunker
+and repeated uploads) through a deterministic fake embedder. Run from the
+project root:
+
+    python -m benchmarks.bench_embeddings [--chunks 2000] [--duplicate 0.2] [--call-size 10]
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from app.embeddings import BatchedEmbedder, VectorCache
+from benchmarks.fake_embedder import FakeEmbedder
+
+
+def _texts(count: int, duplicate: float, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    texts = []
+    for i in range(count):
+        if texts and rng.random() < duplicate:
+            texts.append(rng.choice(texts))
+        else:
+            texts.append(f"chunk {i}: " + " ".join(f"token{rng.randrange(5000)}" for _ in range(200)))
+    return texts
+
+
+async def _run(embed, texts: list[str], call_size: int) -> np.ndarray:
+    # LightRAG calls the embedding function with call_size texts at a time
+    calls = [texts[i:i + call_size] for i in range(0, len(texts), call_size)]
+    return np.concatenate(await asyncio.gather(*(embed(c) for c in calls)))
+
+
+async def _bench(args) -> None:
+    texts = _texts(args.chunks, args.duplicate)
+    print(f"{len(texts)} texts, {len(set(texts))} unique, LightRAG call size {args.call_size}")
+
+    direct = FakeEmbedder()
+    # LightRAG's default embedding_func_max_async bounds the direct path
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def bounded(batch):
+        async with limit:
+            return await direct(batch)
+
+    start = time.perf_counter()
+    expected = await _run(bounded, texts, args.call_size)
+    print(f"{'direct':<16} {time.perf_counter() - start:6.2f} s  {direct.requests:5d} requests  {direct.texts:6d} texts sent")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ("batched (cold)", "batched (warm)"):
+            fake = FakeEmbedder()
+            layer = BatchedEmbedder(
+                fake, fake.dim, "fake", cache=VectorCache(tmp, fake.dim), concurrency=args.concurrency
+            )
+            start = time.perf_counter()
+            # One large call, as LightRAG makes with embedding_batch_num raised
+            result = await _run(layer, texts, len(texts))
+            elapsed = time.perf_counter() - start
+            assert np.allclose(result, expected)
+            print(f"{label:<16} {elapsed:6.2f} s  {fake.requests:5d} requests  {fake.texts:6d} texts sent")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--duplicate", type=float, default=0.2)
+    parser.add_argument("--call-size", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    asyncio.run(_bench(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Wall-clock time of a full handbook: sequential vs parallel section writing.
+
+Uses the fake LLM server with injected per-request latency. Run from the
+project root:
+
+    python -m benchmarks.bench_handbook [--sections 32] [--latency 0.5] [--length-bias 0.6]
+
+``--length-bias`` makes the fake model write that multiple of each step's
+word target, to exercise max_tokens sizing and continuation calls.
+"""
+
+import argparse
+import asyncio
+import time
+
+from app import config, llm_client
+from app.handbook_generator import HandbookDocument, SectionLengths, agenerate_handbook
+from benchmarks.fake_llm import FakeLLMServer, handbook_reply
+
+
+async def _generate(concurrency: int, wave_size: int) -> tuple[float, int, dict]:
+    start = time.perf_counter()
+    document = HandbookDocument()
+    lengths = SectionLengths()
+    async for _ in agenerate_handbook(
+        "Create a handbook on RAG",
+        context="",
+        document=document,
+        concurrency=concurrency,
+        wave_size=wave_size,
+        section_context=False,
+        lengths=lengths,
+    ):
+        pass
+    return time.perf_counter() - start, document.word_count, lengths.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake LLM latency (s)")
+    parser.add_argument("--wave-size", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--length-bias", type=float, default=1.0, help="fake section length / target")
+    args = parser.parse_args()
+
+    reply = handbook_reply(sections=args.sections, section_words=700, length_bias=args.length_bias)
+    with FakeLLMServer(latency=args.latency, reply=reply) as server:
+        config.XAI_API_KEY = "bench"
+        config.XAI_BASE_URL = server.base_url
+
+        baseline = None
+        for concurrency in args.concurrency:
+            elapsed, words, accuracy = asyncio.run(_generate(concurrency, args.wave_size))
+            baseline = baseline or elapsed
+            print(
+                f"concurrency {concurrency:2d}: {elapsed:6.2f} s  "
+                f"({words:,} words, {baseline / elapsed:4.1f}x, "
+                f"{accuracy['within_20pct']}/{accuracy['sections']} sections within 20% of target, "
+                f"{accuracy['continuations']} continuations)"
+            )
+        llm_client.close_clients()
+
+
+if __name__ == "__main__":
+    main()
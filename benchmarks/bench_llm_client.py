@@ -0,0 +1,60 @@
+"""Per-call overhead of a fresh OpenAI client vs the pooled client registry.
+
+Run from the project root:
+
+    python -m benchmarks.bench_llm_client [--calls 200]
+"""
+
+import argparse
+import time
+
+from openai import OpenAI
+
+from app import config, llm_client
+from benchmarks.fake_llm import FakeLLMServer
+
+
+def _fresh_client_call(server: FakeLLMServer) -> None:
+    # Previous behaviour: a new client (and connection pool) on every call
+    client = OpenAI(api_key="bench", base_url=server.base_url)
+    client.chat.completions.create(
+        model=config.GROK_MODEL,
+        messages=[{"role": "user", "content": "ping"}],
+        max_tokens=16,
+    )
+
+
+def _pooled_call(server: FakeLLMServer) -> None:
+    llm_client.chat("ping", max_tokens=16)
+
+
+def _run(label: str, fn, server: FakeLLMServer, calls: int) -> float:
+    fn(server)  # warm-up (imports, first connection)
+    before = server.stats["connections"]
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn(server)
+    elapsed = time.perf_counter() - start
+    opened = server.stats["connections"] - before
+    per_call_ms = elapsed / calls * 1000
+    print(f"{label:<14} {per_call_ms:8.3f} ms/call   {opened:4d} new connections")
+    return per_call_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    with FakeLLMServer() as server:
+        config.XAI_API_KEY = "bench"
+        config.XAI_BASE_URL = server.base_url
+        fresh = _run("fresh client", _fresh_client_call, server, args.calls)
+        pooled = _run("pooled client", _pooled_call, server, args.calls)
+        llm_client.close_clients()
+
+    print(f"speed-up: {fresh / pooled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""PDF extraction throughput vs worker count on generated multi-hundred-page PDFs.
+
+Run from the project root:
+
+    python -m benchmarks.bench_pdf [--files 2] [--pages 300] [--workers 1 2 4]
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from app import config, pdf_processor
+
+LINES_PER_PAGE = 45
+
+
+def write_pdf(path: Path, pages: int, seed: int = 0) -> None:
+    """Write a plain text-only PDF with ``pages`` pages of filler prose."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page objects are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for p in range(pages):
+        lines = [
+            f"Page {p + 1} line {i}: retrieval augmented generation sample {seed}-{p}-{i} "
+            f"knowledge graph entity relation chunk embedding"
+            for i in range(LINES_PER_PAGE)
+        ]
+        ops = ["BT /F1 9 Tf 11 TL 40 800 Td"] + [f"({line}) Tj T*" for line in lines] + ["ET"]
+        stream = "\n".join(ops).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(out))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [Path(tmp) / f"doc{i}.pdf" for i in range(args.files)]
+        for i, path in enumerate(paths):
+            write_pdf(path, args.pages, seed=i)
+        warm = Path(tmp) / "warm.pdf"
+        write_pdf(warm, config.PDF_PAGES_PER_TASK * max(args.workers))
+        total_pages = args.files * args.pages
+        print(f"{args.files} files x {args.pages} pages")
+
+        baseline = None
+        for workers in args.workers:
+            if workers > 1:
+                # Start the worker processes outside the timed region
+                pdf_processor.extract_text(warm, workers=workers)
+            start = time.perf_counter()
+            texts = pdf_processor.extract_texts(paths, workers=workers)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            words = sum(len(t.split()) for t in texts)
+            print(
+                f"workers {workers:2d}: {elapsed:6.2f} s  {total_pages / elapsed:7.1f} pages/s  "
+                f"{baseline / elapsed:4.1f}x  ({words:,} words)"
+            )
+        pdf_processor.shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Chat tail latency with one LLM backend vs two with failover and hedging.
+
+The primary fake server answers most requests in ``--latency`` seconds but
+stalls for ``--stall`` seconds on a ``--tail`` fraction of them and answers
+every ``--fail-every``-th with a 503; the secondary is a little slower but
+steady. Run from the project root:
+
+    python -m benchmarks.bench_router [--requests 200] [--tail 0.05] [--stall 2]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from app import config, llm_client
+from benchmarks.fake_llm import FakeLLMServer
+
+
+def _stalling_reply(tail: float, stall: float, seed: int):
+    rng = random.Random(seed)
+
+    def reply(request: dict) -> str:
+        if rng.random() < tail:
+            time.sleep(stall)
+        return "The paper says so."
+
+    return reply
+
+
+async def _run(requests: int, concurrency: int) -> list[float]:
+    latencies: list[float] = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(number: int):
+        async with gate:
+            started = time.perf_counter()
+            await llm_client.achat(f"Question {number}?", max_tokens=32)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(n) for n in range(requests)))
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="primary latency (s)")
+    parser.add_argument("--tail", type=float, default=0.05, help="fraction of stalled primary requests")
+    parser.add_argument("--stall", type=float, default=2.0, help="extra seconds of a stalled request")
+    parser.add_argument("--fail-every", type=int, default=25, help="every Nth primary request gets a 503")
+    parser.add_argument("--secondary-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    primary = FakeLLMServer(
+        latency=args.latency,
+        reply=_stalling_reply(args.tail, args.stall, seed=7),
+        fail_every=args.fail_every,
+        fail_status=503,
+    )
+    secondary = FakeLLMServer(latency=args.secondary_latency)
+    with primary, secondary:
+        config.XAI_API_KEY = "bench"
+        config.XAI_BASE_URL = primary.base_url
+        config.LLM_BACKOFF_BASE = 0.05
+        config.LLM_HEDGE_MIN_DELAY = 0.1
+        os.environ.update(LLM_BENCH_BASE_URL=secondary.base_url, LLM_BENCH_MODEL="fake")
+
+        for backends in ([], ["grok", "bench"]):
+            config.LLM_BACKENDS = backends
+            llm_client.close_clients()  # fresh router with these backends
+            latencies = asyncio.run(_run(args.requests, args.concurrency))
+            p50 = statistics.median(latencies) * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            routed = llm_client.router_stats()
+            counters = ", ".join(
+                f"{name}: {s['calls']} calls, {s['failures']} failed, {s['hedges']} hedged"
+                for name, s in routed.items()
+            )
+            print(
+                f"{len(backends) or 1} backend{'s' if backends else ' '}  "
+                f"chat p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  ({counters})"
+            )
+        llm_client.close_clients()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Chat latency while a parallel handbook saturates the LLM request scheduler.
+
+The fake LLM server answers every ``--fail-every``-th request with a 429 and
+a Retry-After, and only ``--inflight`` requests may be on the wire at once.
+Chat runs once with priority lanes (chat admitted ahead of queued handbook
+sections) and once in plain arrival order. Run from the project root:
+
+    python -m benchmarks.bench_scheduler [--users 10] [--inflight 4] [--fail-every 10]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from app import config, llm_client
+from app.handbook_generator import agenerate_handbook
+from benchmarks.fake_llm import FakeLLMServer, handbook_reply
+
+THINK_TIME = 0.25
+
+
+async def _handbook(concurrency: int):
+    async for _ in agenerate_handbook(
+        "Create a handbook on RAG", context="", concurrency=concurrency, section_context=False
+    ):
+        pass
+
+
+async def _user(turns: int, latencies: list[float]):
+    for _ in range(turns):
+        started = time.perf_counter()
+        await llm_client.achat("What does the paper say?")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(THINK_TIME)
+
+
+async def _scenario(users: int, turns: int, concurrency: int) -> tuple[list[float], float]:
+    latencies: list[float] = []
+    started = time.perf_counter()
+    book = asyncio.create_task(_handbook(concurrency))
+    await asyncio.sleep(0.2)  # let the handbook fill the queue before users arrive
+    await asyncio.gather(*(_user(turns, latencies) for _ in range(users)))
+    await book
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--sections", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, default=8, help="handbook sections in flight")
+    parser.add_argument("--inflight", type=int, default=4, help="scheduler LLM_MAX_INFLIGHT")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency (s)")
+    parser.add_argument("--fail-every", type=int, default=10, help="every Nth request gets a 429")
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    args = parser.parse_args()
+
+    reply = handbook_reply(sections=args.sections, section_words=200)
+    with FakeLLMServer(
+        latency=args.latency, reply=reply, fail_every=args.fail_every, retry_after=args.retry_after
+    ) as server:
+        config.XAI_API_KEY = "bench"
+        config.XAI_BASE_URL = server.base_url
+        config.LLM_MAX_INFLIGHT = args.inflight
+        config.HANDBOOK_LLM_SUMMARIES = False
+
+        for lanes in (False, True):
+            config.LLM_PRIORITY_LANES = lanes
+            llm_client.close_clients()  # fresh scheduler with these settings
+            latencies, elapsed = asyncio.run(_scenario(args.users, args.turns, args.concurrency))
+            stats = llm_client.scheduler_stats()
+            ordered = sorted(latencies)
+            p50 = statistics.median(ordered) * 1000
+            p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+            print(
+                f"{'lanes' if lanes else 'fifo':<6} chat p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  "
+                f"handbook done in {elapsed:5.2f} s  "
+                f"({stats['retries']} retries, {stats['rate_limited']} rate-limited)"
+            )
+        llm_client.close_clients()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Deterministic local stand-in for an embeddings API.
+
+Each text maps to a fixed pseudo-random unit vector derived from its hash,
+and every request costs ``latency`` seconds plus ``per_text`` per input, so
+batching and caching effects show up without network access or API keys.
+"""
+
+import asyncio
+import hashlib
+
+import numpy as np
+
+
+class FakeEmbedder:
+    def __init__(self, dim: int = 1536, latency: float = 0.05, per_text: float = 0.0005):
+        self.dim = dim
+        self.latency = latency
+        self.per_text = per_text
+        self.requests = 0
+        self.texts = 0
+
+    def vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        v = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return v / np.linalg.norm(v)
+
+    async def __call__(self, texts: list[str], **kwargs) -> np.ndarray:
+        self.requests += 1
+        self.texts += len(texts)
+        await asyncio.sleep(self.latency + self.per_text * len(texts))
+        return np.stack([self.vector(t) for t in texts])
@@ -0,0 +1,210 @@
+"""Local OpenAI-compatible stub server used by the benchmarks.
+
+Serves ``/v1/chat/completions`` (plain and SSE streaming) from a background
+thread with configurable latency, so benchmarks exercise the real HTTP client
+stack without touching the network.
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is visible
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict | None = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            number = self.server.stats["requests"]
+
+        fake = self.server.fake
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        time.sleep(fake.latency)
+        if fake.fail_every and number % fake.fail_every == 0:
+            with self.server.stats_lock:
+                self.server.stats["failures"] += 1
+            headers = {"Retry-After": str(fake.retry_after)} if fake.retry_after is not None else {}
+            self._send_json(
+                fake.fail_status,
+                {"error": {"message": "injected failure", "type": "rate_limit_error"}},
+                headers,
+            )
+            return
+        text = fake.reply(request)
+        if request.get("stream"):
+            self._stream(text, fake)
+            return
+        self._send_json(200, {
+            "id": "fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": 0},
+        })
+
+    def _stream(self, text: str, fake: "FakeLLMServer"):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = text.split(" ")
+        for i in range(0, len(words), fake.chunk_words):
+            piece = " ".join(words[i:i + fake.chunk_words])
+            if i:
+                piece = " " + piece
+            self._write_event({
+                "id": "fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "fake",
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            })
+            time.sleep(fake.token_latency)
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, payload: dict):
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode())
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # default of 5 drops SYNs under concurrent load
+
+
+def _default_reply(request: dict) -> str:
+    return " ".join(["lorem"] * 50)
+
+
+_TASK_WORDS_RE = re.compile(r"YOUR TASK: Write .*?Word Count: (\d+) words")
+_MORE_WORDS_RE = re.compile(r"YOUR TASK: Continue this section with about (\d+) more words")
+
+
+def handbook_reply(
+    sections: int = 30, section_words: int = 700, chat_words: int = 50, length_bias: float = 1.0
+):
+    """Reply function that answers plan, section-writing and chat prompts.
+
+    Plan prompts get ``sections`` well-formed subtask lines of
+    ``section_words`` words each. Write prompts get the step's word target
+    times ``length_bias`` (a model that writes short or long), continuation
+    prompts the words they ask for, both cut at the request's ``max_tokens``
+    (one token per filler word). Anything else gets a short answer.
+    """
+    plan = "\n\n".join(
+        f"Paragraph {i} - Main Point: Topic {i} in depth - Word Count: {section_words} words"
+        for i in range(1, sections + 1)
+    )
+
+    def reply(request: dict) -> str:
+        prompt = request["messages"][-1]["content"]
+        if "create a detailed outline" in prompt:
+            return plan
+        limit = request.get("max_tokens") or sys.maxsize
+        task = _TASK_WORDS_RE.search(prompt)
+        if task:
+            return " ".join(["handbook"] * min(int(int(task.group(1)) * length_bias), limit))
+        more = _MORE_WORDS_RE.search(prompt)
+        if more:
+            return " ".join(["more"] * min(int(more.group(1)), limit))
+        return " ".join(["answer"] * chat_words)
+
+    return reply
+
+
+class FakeLLMServer:
+    """Threaded stub of the chat completions endpoint.
+
+    Use as a context manager; ``base_url`` is ready to hand to an OpenAI client.
+    With ``fail_every`` = N every Nth request is answered with ``fail_status``
+    (429 by default) and, if ``retry_after`` is set, a Retry-After header.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        reply=_default_reply,
+        chunk_words: int = 5,
+        token_latency: float = 0.0,
+        fail_every: int = 0,
+        fail_status: int = 429,
+        retry_after: float | None = None,
+    ):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.reply = reply
+        self.chunk_words = chunk_words
+        self.token_latency = token_latency
+        self._httpd: _Server | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def stats(self) -> dict:
+        with self._httpd.stats_lock:
+            return dict(self._httpd.stats)
+
+    def start(self) -> "FakeLLMServer":
+        httpd = _Server(("127.0.0.1", 0), _Handler)
+        httpd.fake = self
+        httpd.stats = {"requests": 0, "connections": 0, "failures": 0}
+        httpd.stats_lock = threading.Lock()
+        self._httpd = httpd
+        self._thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self) -> "FakeLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
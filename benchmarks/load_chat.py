@@ -0,0 +1,91 @@
+"""Chat latency for N concurrent users while a handbook is being generated.
+
+Compares the old blocking path (sync ``chat`` / ``generate_handbook`` called
+from coroutines) with the async path (``achat`` / ``agenerate_handbook``),
+all on one event loop like Gradio's. Run from the project root:
+
+    python -m benchmarks.load_chat [--users 20] [--turns 5]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from app import config, llm_client
+from app.handbook_generator import agenerate_handbook, generate_handbook
+from benchmarks.fake_llm import FakeLLMServer, handbook_reply
+
+
+async def _handbook_sync():
+    for _ in generate_handbook("Create a handbook on RAG", context="", section_context=False):
+        await asyncio.sleep(0)  # the old handler yielded to Gradio per section
+
+
+async def _handbook_async():
+    async for _ in agenerate_handbook("Create a handbook on RAG", context="", section_context=False):
+        pass
+
+
+# Users send a message every THINK_TIME seconds. Latency is measured from the
+# moment the message was sent, so time spent waiting for a blocked event loop
+# counts against the user just as it would in the browser.
+THINK_TIME = 0.25
+
+
+async def _user(ask, turns: int, latencies: list[float]):
+    start = time.perf_counter()
+    for turn in range(turns):
+        sent_at = start + turn * THINK_TIME
+        await asyncio.sleep(max(0.0, sent_at - time.perf_counter()))
+        await ask()
+        latencies.append(time.perf_counter() - sent_at)
+
+
+async def _ask_sync():
+    llm_client.chat("What does the paper say?")
+
+
+async def _ask_async():
+    await llm_client.achat("What does the paper say?")
+
+
+async def _scenario(handbook, ask, users: int, turns: int) -> tuple[list[float], float]:
+    latencies: list[float] = []
+    book = asyncio.create_task(handbook())
+    await asyncio.sleep(0.01)  # let generation start before users arrive
+    started = time.perf_counter()
+    await asyncio.gather(*(_user(ask, turns, latencies) for _ in range(users)))
+    elapsed = time.perf_counter() - started
+    await book
+    return latencies, elapsed
+
+
+def _report(label: str, latencies: list[float], elapsed: float) -> None:
+    ordered = sorted(latencies)
+    p50 = statistics.median(ordered) * 1000
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000
+    print(f"{label:<6} p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   all users done in {elapsed:6.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake LLM latency (s)")
+    args = parser.parse_args()
+
+    reply = handbook_reply(sections=args.sections, section_words=200)
+    with FakeLLMServer(latency=args.latency, reply=reply) as server:
+        config.XAI_API_KEY = "bench"
+        config.XAI_BASE_URL = server.base_url
+        config.LLM_MAX_CONNECTIONS = max(config.LLM_MAX_CONNECTIONS, args.users + 1)
+
+        _report("sync", *asyncio.run(_scenario(_handbook_sync, _ask_sync, args.users, args.turns)))
+        _report("async", *asyncio.run(_scenario(_handbook_async, _ask_async, args.users, args.turns)))
+        llm_client.close_clients()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 """Entry point for the Handbook Generator application."""
 
 import asyncio
-import tempfile
+import time
 import gradio as gr
 from pathlib import Path
 
 from app import config
-from app.pdf_processor import extract_text
 from app import rag_engine
-from app.llm_client import chat
-from app.handbook_generator import generate_handbook
+from app.ingestion import ingest_files
+from app.llm_client import achat_stream
+from app.handbook_generator import HandbookDocument, SectionLengths, agenerate_handbook
+from app.handbook_journal import HandbookJournal
 
 
 def main():
@@ -20,8 +21,25 @@ def main():
         print("Copy .env.example to .env and fill in your API keys.")
         return
 
+    # Load the knowledge graph and vector stores while the UI comes up
+    if config.RAG_WARMUP:
+        def report_warm_up(future):
+            if future.exception() is not None:
+                print(f"RAG warm-up failed: {future.exception()}")
+            else:
+                print(f"RAG index loaded in {rag_engine.startup_timings()['init_seconds']:.1f} s")
+
+        rag_engine.warm_up().add_done_callback(report_warm_up)
+
     # Stores the latest handbook text for download
     _latest_handbook = {"text": ""}
+    _first_query = {"reported": False}
+
+    def report_first_query():
+        timings = rag_engine.startup_timings()
+        if not _first_query["reported"] and "first_query_seconds" in timings:
+            _first_query["reported"] = True
+            print(f"First RAG query answered in {timings['first_query_seconds']:.1f} s")
 
     # ------------------------------------------------------------------ #
     #  Event handlers                                                      #
@@ -30,13 +48,22 @@ def main():
     async def handle_upload(files, progress=gr.Progress()):
         if not files:
             return "No files selected."
-        status_parts = []
-        for i, f in enumerate(files):
-            progress((i, len(files)), desc=f"Indexing {Path(f.name).name}...")
-            text = extract_text(f.name)
-            word_count = len(text.split())
-            await rag_engine.insert_document(text)
-            status_parts.append(f"{Path(f.name).name}: {word_count:,} words indexed")
+
+        finished: set[str] = set()
+
+        def report(item):
+            if item.done:
+                finished.add(str(item.path))
+            desc = f"{item.name}: {item.chunks_inserted}/{item.chunks_extracted} chunks indexed"
+            progress((len(finished), len(files)), desc=desc)
+
+        # Extraction of one file overlaps with indexing of the others
+        progress((0, len(files)), desc=f"Indexing {len(files)} file(s)...")
+        try:
+            results = await ingest_files([f.name for f in files], on_progress=report)
+        except Exception as e:
+            return f"Indexing failed: {e}"
+        status_parts = [item.status_line() for item in results]
         return "\n".join(status_parts)
 
     async def handle_chat(message, history):
@@ -66,56 +93,105 @@ def main():
                 context = await rag_engine.query(message, mode="hybrid")
             except Exception:
                 context = ""
+            report_first_query()
 
-            # Stream handbook generation progress
+            # Stream handbook generation progress. The status line and the
+            # handbook body are separate messages: the body only ever grows,
+            # so Gradio's streaming diff sends just the appended text instead
+            # of re-serializing the whole document on every update.
             history = history + [{"role": "assistant", "content": "Planning handbook structure..."}]
+            status_idx = len(history) - 1
             yield history, "", gr.update(visible=False), None
 
-            word_count = 0
-            for step_num, total_steps, accumulated_text in generate_handbook(
-                instruction=message, context=context
+            # Resumes an interrupted run of the same instruction, if any
+            journal = HandbookJournal.for_instruction(message)
+            document = HandbookDocument()
+            lengths = SectionLengths()
+            body = ""
+            total_steps = 0
+            last_flush = 0.0
+            async for step_num, total_steps, delta in agenerate_handbook(
+                instruction=message,
+                context=context,
+                document=document,
+                stream=True,
+                journal=journal,
+                lengths=lengths,
             ):
-                word_count = len(accumulated_text.split())
-                progress_header = (
-                    f"**Generating handbook: section {step_num}/{total_steps} "
-                    f"| {word_count:,} words so far**\n\n---\n\n"
-                )
-                history[-1] = {
+                if step_num == 0:
+                    history[status_idx] = {"role": "assistant", "content": delta}
+                    history = history + [{"role": "assistant", "content": ""}]
+                    yield history, "", gr.update(visible=False), None
+                    continue
+
+                body += delta
+                now = time.monotonic()
+                if now - last_flush < config.HANDBOOK_STREAM_INTERVAL:
+                    continue
+                last_flush = now
+                history[status_idx] = {
                     "role": "assistant",
-                    "content": progress_header + accumulated_text,
+                    "content": (
+                        f"**Generating handbook: section {step_num}/{total_steps} "
+                        f"| {document.word_count:,} of ~{document.target_words:,} words**"
+                    ),
                 }
+                history[-1] = {"role": "assistant", "content": body}
                 yield history, "", gr.update(visible=False), None
 
             # Save handbook for download
-            _latest_handbook["text"] = accumulated_text
+            handbook_text = document.text()
+            _latest_handbook["text"] = handbook_text
             handbook_path = Path(config.RAG_WORKING_DIR) / "handbook.md"
             handbook_path.parent.mkdir(parents=True, exist_ok=True)
-            handbook_path.write_text(accumulated_text, encoding="utf-8")
+            handbook_path.write_text(handbook_text, encoding="utf-8")
+            journal.finish()
 
             # Final update with completion message + show download
-            final_header = f"**Handbook complete: {word_count:,} words | {total_steps} sections**\n\n---\n\n"
-            history[-1] = {
+            accuracy = lengths.stats()
+            if accuracy["sections"]:
+                print(
+                    f"Handbook section lengths: {accuracy['within_20pct']}/{accuracy['sections']} within 20% "
+                    f"of target, mean error {accuracy['mean_abs_error']:.0%}, "
+                    f"{accuracy['continuations']} continuation(s), {accuracy['tokens_per_word']} tokens/word"
+                )
+            history[status_idx] = {
                 "role": "assistant",
-                "content": final_header + accumulated_text,
+                "content": f"**Handbook complete: {document.word_count:,} words | {total_steps} sections**",
             }
+            history[-1] = {"role": "assistant", "content": handbook_text}
             yield history, "", gr.update(visible=True), str(handbook_path)
 
         else:
-            # Regular RAG chat
+            # Regular RAG chat: retrieval only, then one streamed generation
             try:
-                context = await rag_engine.query(message, mode="hybrid")
+                context = await rag_engine.retrieve_context(message, mode="hybrid")
             except Exception:
                 context = "(No documents indexed yet. Upload PDFs first.)"
+            if not context:
+                context = "(Nothing relevant found in the uploaded documents.)"
+            report_first_query()
 
             prompt = (
                 f"Context from uploaded documents:\n{context}\n\n"
                 f"User question: {message}"
             )
-            response = chat(
+            history = history + [{"role": "assistant", "content": ""}]
+            response = ""
+            last_flush = 0.0
+            async for chunk in achat_stream(
                 prompt,
                 system="You are a helpful assistant. Answer based on the provided document context. If the context is insufficient, say so.",
-            )
-            history = history + [{"role": "assistant", "content": response}]
+            ):
+                response += chunk
+                now = time.monotonic()
+                if now - last_flush < config.HANDBOOK_STREAM_INTERVAL:
+                    continue
+                last_flush = now
+                history[-1] = {"role": "assistant", "content": response}
+                yield history, "", gr.update(visible=False), None
+
+            history[-1] = {"role": "assistant", "content": response}
             yield history, "", gr.update(visible=False), None
 
     # ------------------------------------------------------------------ #
@@ -0,0 +1,31 @@
+from app.handbook_journal import HandbookJournal
+
+
+def test_resume_after_torn_write(tmp_path):
+    path = tmp_path / "run.jsonl"
+    journal = HandbookJournal(path)
+    journal.record_plan(["Paragraph 1", "Paragraph 2", "Paragraph 3"])
+    journal.record_section(0, "First.")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "section", "index": 1, "te')  # crash mid-write
+
+    resumed = HandbookJournal(path)
+    assert resumed.completed() == 1
+    resumed.record_section(1, "Second.")
+    resumed.record_section(2, "Third.")
+
+    reloaded = HandbookJournal(path)
+    assert reloaded.completed() == 3
+    assert reloaded.sections[2] == "Third."
+
+
+def test_plan_resets_sections(tmp_path):
+    path = tmp_path / "run.jsonl"
+    journal = HandbookJournal(path)
+    journal.record_plan(["Paragraph 1"])
+    journal.record_section(0, "Old.")
+    journal.record_plan(["Paragraph 1", "Paragraph 2"])
+
+    reloaded = HandbookJournal(path)
+    assert reloaded.steps == ["Paragraph 1", "Paragraph 2"]
+    assert reloaded.completed() == 0
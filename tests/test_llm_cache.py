@@ -0,0 +1,64 @@
+import asyncio
+
+from app.llm_cache import ResponseCache
+
+
+def _cache(tmp_path) -> ResponseCache:
+    return ResponseCache(tmp_path / "cache.sqlite", max_bytes=1 << 20)
+
+
+def test_async_requests_share_one_call(tmp_path):
+    cache = _cache(tmp_path)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_compute("k", compute) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["answer"] * 3
+    assert len(calls) == 1
+    assert cache.get("k") == "answer"
+
+
+def test_keep_false_shares_but_does_not_store(tmp_path):
+    cache = _cache(tmp_path)
+
+    async def compute():
+        return "failover answer"
+
+    assert asyncio.run(cache.aget_or_compute("k", compute, keep=lambda: False)) == "failover answer"
+    assert cache.get("k") is None
+
+
+def test_concurrent_stream_is_not_held_back(tmp_path):
+    cache = _cache(tmp_path)
+
+    async def main():
+        finished = asyncio.Event()
+
+        async def slow_stream():
+            yield "a"
+            await finished.wait()
+            yield "b"
+
+        async def fast_stream():
+            yield "x"
+
+        async def lead():
+            return [c async for c in cache.astream("k", slow_stream)]
+
+        leader = asyncio.create_task(lead())
+        await asyncio.sleep(0.01)
+        # The leader is still streaming; a second request streams on its own
+        follower = [c async for c in cache.astream("k", fast_stream)]
+        finished.set()
+        return await leader, follower
+
+    leader, follower = asyncio.run(main())
+    assert leader == ["a", "b"]
+    assert follower == ["x"]
+    assert cache.get("k") == "ab"
@@ -0,0 +1,80 @@
+from app import config
+from app.handbook_generator import _parse_plan
+
+
+def _parsed(response, **kwargs):
+    return [(s.index, s.main_point, s.target_words) for s in _parse_plan(response, **kwargs)]
+
+
+def test_canonical_lines():
+    plan = (
+        "Paragraph 1 - Main Point: Introduction - Word Count: 500 words\n"
+        "Paragraph 2 - Main Point: Retrieval - Word Count: 800 words"
+    )
+    assert _parsed(plan) == [(0, "Introduction", 500), (1, "Retrieval", 800)]
+
+
+def test_bold_labels():
+    plan = (
+        "**Paragraph 1 - Main Point:** Intro - **Word Count:** 700 words\n"
+        "* __Step 2:__ Indexing with snake_case names - *Word Count*: 600 words"
+    )
+    assert _parsed(plan) == [(0, "Intro", 700), (1, "Indexing with snake_case names", 600)]
+
+
+def test_headings_and_chatter_are_dropped():
+    plan = (
+        "Here is the plan:\n"
+        "\n"
+        "## Part 1: Foundations\n"
+        "Paragraph 1 - Main Point: Intro - Word Count: 500 words\n"
+        "**Part 2: Practice**\n"
+        "Paragraph 2 - Main Point: Pipelines\n"
+        "\n"
+        "Let me know if you want changes!"
+    )
+    assert _parsed(plan) == [(0, "Intro", 500), (1, "Pipelines", config.HANDBOOK_STEP_WORDS)]
+
+
+def test_wrapped_description_is_joined():
+    plan = (
+        "Paragraph 1 - Main Point: Background on retrieval\n"
+        "  and indexing - Word Count: 600 words\n"
+        "Paragraph 2 - Main Point: Evaluation\n"
+        "(800 words)"
+    )
+    assert _parsed(plan) == [(0, "Background on retrieval and indexing", 600), (1, "Evaluation", 800)]
+
+
+def test_targets_are_clamped_and_ranges_averaged():
+    plan = (
+        "1. Tiny note - Word Count: 10 words\n"
+        "2. Giant chapter - Word Count: 90,000 words\n"
+        "3. Middle (600-800 words)"
+    )
+    assert [s.target_words for s in _parse_plan(plan)] == [
+        config.HANDBOOK_MIN_STEP_WORDS,
+        config.HANDBOOK_MAX_STEP_WORDS,
+        700,
+    ]
+
+
+def test_excess_steps_are_merged():
+    plan = "\n".join(f"Paragraph {i} - Main Point: Topic {i} - Word Count: 300 words" for i in range(1, 11))
+    steps = _parse_plan(plan, max_steps=4)
+    assert len(steps) == 4
+    assert [s.index for s in steps] == [0, 1, 2, 3]
+    assert sum(s.target_words for s in steps) == 3000
+
+
+def test_unlabelled_reply_falls_back_to_lines():
+    assert _parsed("Intro\nBasics\n\nAdvanced topics") == [
+        (0, "Intro", config.HANDBOOK_STEP_WORDS),
+        (1, "Basics", config.HANDBOOK_STEP_WORDS),
+        (2, "Advanced topics", config.HANDBOOK_STEP_WORDS),
+    ]
+
+
+def test_canonical_form_round_trips():
+    steps = _parse_plan("**Step 1:** Intro (650 words)\n- 2) Outro - Word Count: 400")
+    assert _parsed("\n".join(s.line() for s in steps)) == [(0, "Intro", 650), (1, "Outro", 400)]
@@ -0,0 +1,49 @@
+from concurrent.futures import Future
+
+from app import handbook_generator
+from app.handbook_generator import HandbookDocument, SectionMemory
+
+
+class _Pool:
+    """Summary pool that queues calls without running them."""
+
+    def __init__(self):
+        self.calls: list[Future] = []
+
+    def submit(self, fn, prompt, **kwargs):
+        future = Future()
+        future.prompt = prompt
+        self.calls.append(future)
+        return future
+
+
+def _document(sections: int) -> HandbookDocument:
+    document = HandbookDocument()
+    for i in range(sections):
+        document.append(f"Section {i} explains topic {i} in some detail. It has a second sentence.")
+    return document
+
+
+def test_catch_up_summarizes_only_surviving_entries(monkeypatch):
+    pool = _Pool()
+    monkeypatch.setattr(handbook_generator, "_get_summary_pool", lambda: pool)
+    memory = SectionMemory(slots=4, merge=2, use_llm=True)
+
+    memory.catch_up(_document(10))
+
+    assert len(memory) == 10
+    assert len(memory.entries) <= 4
+    assert len(pool.calls) == len(memory.entries)
+    assert all(entry.future in pool.calls for entry in memory.entries)
+
+
+def test_roll_up_cancels_merged_summaries(monkeypatch):
+    pool = _Pool()
+    monkeypatch.setattr(handbook_generator, "_get_summary_pool", lambda: pool)
+    memory = SectionMemory(slots=2, merge=2, use_llm=True)
+
+    for i, section in enumerate(_document(3).sections):
+        memory.add(i, section)
+
+    assert [(e.first, e.last) for e in memory.entries] == [(0, 1), (2, 2)]
+    assert [f.cancelled() for f in pool.calls] == [True, True, False, False]